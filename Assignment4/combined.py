@@ -1,17 +1,20 @@
 import vtk
 import argparse
+from resample_vfem import open_vfem
+from parallel_tracer import ParallelStreamTracer
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", type=str, help="path to vfem.vtu file")
     parser.add_argument("-g", type=str, help="path to wing.vtp file")
+    parser.add_argument("--resample", type=int, nargs=3, metavar=("NX", "NY", "NZ"),
+                        help="run on a cached resampling of vfem.vtu on a regular grid (see resample_vfem.py)")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of streamline tracing processes")
     return parser.parse_args()
 
-def read_vfem_velocity(vfem_filename):
-    reader = vtk.vtkXMLUnstructuredGridReader()
-    reader.SetFileName(vfem_filename)
-    reader.Update()
+def read_vfem_velocity(vfem_filename, resample=None):
+    reader = open_vfem(vfem_filename, resample)
     velocity_range = reader.GetOutput().GetPointData().GetArray("velocity").GetRange()
     pressure_range = reader.GetOutput().GetPointData().GetArray("pressure").GetRange()
     # pressure_range = [43000, 45000]
@@ -104,13 +107,13 @@ def main():
     seeds.SetResolution(15, 15)
     seeds.SetNormal(1, 0, 0)
 
-    reader, velocity_range, pressure_range = read_vfem_velocity(vfem_filename)
+    reader, velocity_range, pressure_range = read_vfem_velocity(vfem_filename, args.resample)
 
     source = build_source_around_vortices(n_seeds=50)
 
-    streamline = vtk.vtkStreamTracer()
-    streamline.SetSourceConnection(source.GetOutputPort())
-    streamline.SetInputConnection(reader.GetOutputPort())
+    with ParallelStreamTracer(vfem_filename, args.resample, args.workers, dataset=reader.GetOutput()) as tracer:
+        streamline = vtk.vtkTrivialProducer()
+        streamline.SetOutput(tracer.trace(source))
 
     streamline_actor, _ = build_velocity_actor(streamline.GetOutputPort(), velocity_range)
 
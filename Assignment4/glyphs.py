@@ -1,16 +1,26 @@
 import vtk
 import argparse
+import numpy as np
+from vtk.util import numpy_support as nps
+from resample_vfem import open_vfem
+from probe_helper import SharedProbe
+from vtk_io_helper import readVTK_XML_metadata, printVTK_XML_metadata
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", type=str, help="path to vfem.vtu file")
     parser.add_argument("-g", type=str, help="path to wing.vtp file")
+    parser.add_argument("--resample", type=int, nargs=3, metavar=("NX", "NY", "NZ"),
+                        help="run on a cached resampling of vfem.vtu on a regular grid (see resample_vfem.py)")
+    parser.add_argument("--glyphs", choices=["instanced", "geometry"], default="instanced",
+                        help="draw instances of one arrow (vtkGlyph3DMapper) or copy the arrow for each point (vtkGlyph3D)")
+    parser.add_argument("--mask-invalid", action="store_true",
+                        help="drop the probe points outside the mesh or with zero velocity")
 
     return parser.parse_args()
 
 def read_input(args):
-    vfem_reader =vtk.vtkXMLUnstructuredGridReader()
-    vfem_reader.SetFileName(args.i)
+    vfem_reader = open_vfem(args.i, args.resample)
     wing_reader = vtk.vtkXMLPolyDataReader()
     wing_reader.SetFileName(args.g)
     wing_reader.Update()
@@ -28,7 +38,7 @@ def build_actor(reader, lut = None, prange = None):
     return actor
 
 
-def build_arrow_plane_actor(reader_output_port, x, wing_bounds, lut):
+def build_arrow_plane(x, wing_bounds):
     vector_bounds = wing_bounds
     y_min, y_max = vector_bounds[2] , vector_bounds[3] 
     z_min, z_max = vector_bounds[4] - 0.2, vector_bounds[5] + 0.2
@@ -47,48 +57,81 @@ def build_arrow_plane_actor(reader_output_port, x, wing_bounds, lut):
     # tpd_filter.SetInputConnection(plane.GetOutputPort())
     # tpd_filter.SetTransform(trans)
 
-    probe_filter = vtk.vtkProbeFilter()
-    probe_filter.SetInputConnection(plane.GetOutputPort())
-    probe_filter.SetSourceConnection(reader_output_port)
-
+    plane.Update()
+    return plane.GetOutput()
+
+'''
+Probed points that lie in the mesh (vtkValidPointMask of the probe) and
+have a nonzero velocity, with their point arrays, so that glyph memory and
+build time only depend on the number of arrows actually drawn
+'''
+def mask_invalid_points(probed_plane):
+    point_data = probed_plane.GetPointData()
+    velocity = nps.vtk_to_numpy(point_data.GetArray("velocity"))
+    keep = np.linalg.norm(velocity, axis=1) > 0
+    valid = point_data.GetArray("vtkValidPointMask")
+    if valid is not None:
+        keep &= nps.vtk_to_numpy(valid) != 0
+
+    points = vtk.vtkPoints()
+    points.SetData(nps.numpy_to_vtk(nps.vtk_to_numpy(probed_plane.GetPoints().GetData())[keep], deep=True))
+    masked = vtk.vtkPolyData()
+    masked.SetPoints(points)
+    for i in range(point_data.GetNumberOfArrays()):
+        array = point_data.GetArray(i)
+        values = nps.numpy_to_vtk(nps.vtk_to_numpy(array)[keep], deep=True, array_type=array.GetDataType())
+        values.SetName(array.GetName())
+        masked.GetPointData().AddArray(values)
+    for attribute in [ vtk.vtkDataSetAttributes.SCALARS, vtk.vtkDataSetAttributes.VECTORS ]:
+        array = point_data.GetAttribute(attribute)
+        if array is not None:
+            masked.GetPointData().SetActiveAttribute(array.GetName(), attribute)
+    return masked
+
+def build_arrow_source():
     arrow_source = vtk.vtkArrowSource()
     arrow_source.SetShaftResolution(20)
     arrow_source.SetTipResolution(20)
     arrow_source.SetShaftRadius(0.02)
     arrow_source.SetTipRadius(0.1)
+    return arrow_source
+
+# arrow glyphs on a plane that was already probed (see build_arrow_plane)
+def build_arrow_plane_actor(probed_plane, lut, arrow_source=None):
+    if arrow_source is None:
+        arrow_source = build_arrow_source()
 
     arrow_glyph_filter = vtk.vtkGlyph3D()
     arrow_glyph_filter.SetScaleFactor(0.000001)
-    arrow_glyph_filter.SetInputConnection(probe_filter.GetOutputPort())
+    arrow_glyph_filter.SetInputData(probed_plane)
     arrow_glyph_filter.SetSourceConnection(arrow_source.GetOutputPort())
     return arrow_glyph_filter
 
+'''
+Same arrows as build_arrow_plane_actor (oriented along the velocity, scaled
+and colored by pressure), drawn as instances of a single arrow template
+with per-point orientation and scale arrays instead of one copy of the
+arrow mesh per point
+'''
+def build_instanced_arrow_actor(probed_plane, arrow_source, lut, prange):
+    mapper = vtk.vtkGlyph3DMapper()
+    mapper.SetInputData(probed_plane)
+    mapper.SetSourceConnection(arrow_source.GetOutputPort())
+    mapper.SetOrientationArray("velocity")
+    mapper.SetOrientationModeToDirection()
+    mapper.SetScaleArray("pressure")
+    mapper.SetScaleModeToScaleByMagnitude()
+    mapper.SetScaleFactor(0.000001)
+    mapper.SetLookupTable(lut)
+    mapper.SetScalarRange(prange)
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    return actor
 
-def inspect_vtu(file_path):
-    reader = vtk.vtkXMLUnstructuredGridReader()
-    reader.SetFileName(file_path)
-    reader.Update()  
-
-    data = reader.GetOutput()
-
-    print(f"Number of Points: {data.GetNumberOfPoints()}")
-    print(f"Number of Cells: {data.GetNumberOfCells()}")
-    
-    point_data = data.GetPointData()
-    print("\nPoint Data Arrays:")
-    for i in range(point_data.GetNumberOfArrays()):
-        array_name = point_data.GetArrayName(i)
-        array = point_data.GetArray(i)
-        print(f"  {i}. {array_name} - {array.GetNumberOfComponents()} components")
-
-    cell_data = data.GetCellData()
-    print("\nCell Data Arrays:")
-    for i in range(cell_data.GetNumberOfArrays()):
-        array_name = cell_data.GetArrayName(i)
-        array = cell_data.GetArray(i)
-        print(f"  {i}. {array_name} - {array.GetNumberOfComponents()} components")
 
-    print("\nBounds of the dataset:", data.GetBounds())
+# Summary of a .vtu file read from its XML header only, without loading the data
+def inspect_vtu(file_path):
+    printVTK_XML_metadata(readVTK_XML_metadata(file_path))
 
 
 def main():
@@ -115,10 +158,20 @@ def main():
 
     wingBounds = wing_reader.GetOutput().GetBounds()
     plane_x_coords = [0.1, 0.3, 0.5]
+    # all the planes are probed at once with a single cell locator
+    probe = SharedProbe(vfem_reader.GetOutput())
+    planes = probe.probe(*[ build_arrow_plane(x, wingBounds) for x in plane_x_coords ])
+    if args.mask_invalid:
+        planes = [ mask_invalid_points(plane) for plane in planes ]
+    # one arrow template shared by all the planes
+    arrow_source = build_arrow_source()
     arrow_actors = []
-    for x in plane_x_coords:
-        arrow_glyph_filter = build_arrow_plane_actor(vfem_reader.GetOutputPort(), x, wingBounds, lut)
-        arrow_actor = build_actor(arrow_glyph_filter, lut, prange)
+    for plane in planes:
+        if args.glyphs == "instanced":
+            arrow_actor = build_instanced_arrow_actor(plane, arrow_source, lut, prange)
+        else:
+            arrow_glyph_filter = build_arrow_plane_actor(plane, lut, arrow_source)
+            arrow_actor = build_actor(arrow_glyph_filter, lut, prange)
         arrow_actors.append(arrow_actor)
 
 
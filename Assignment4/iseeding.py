@@ -9,6 +9,13 @@ import sys
 import argparse
 import numpy as np
 import json
+from resample_vfem import open_vfem
+from parallel_tracer import ParallelStreamTracer
+from stream_worker import StreamlineWorker
+
+# carries traced streamlines from the worker thread to the GUI thread
+class TraceSignal(QtCore.QObject):
+    traced = QtCore.pyqtSignal(object, int)
 
 class InteractiveSeedingUI(QMainWindow):
     def __init__(self, args, parent=None):
@@ -19,6 +26,7 @@ class InteractiveSeedingUI(QMainWindow):
         self.setup_sliders()
         self.setup_connections()
         self.setup_sphere_widget()
+        self.update_streamlines()
 
     def setup_ui(self):
         self.centralWidget = QWidget()
@@ -41,9 +49,7 @@ class InteractiveSeedingUI(QMainWindow):
 
     def setup_vtk_pipeline(self):
         # Read input data
-        self.reader = vtk.vtkXMLUnstructuredGridReader()
-        self.reader.SetFileName(self.args.i)
-        self.reader.Update()
+        self.reader = open_vfem(self.args.i, self.args.resample)
         
         # Wing geometry
         wing_reader = vtk.vtkXMLPolyDataReader()
@@ -54,21 +60,26 @@ class InteractiveSeedingUI(QMainWindow):
         self.wing_actor.SetMapper(wing_mapper)
         self.wing_actor.GetProperty().SetColor(0.5, 0.5, 0.5)
 
-        # Streamline setup
+        # Streamline setup: seeds are traced in a worker thread and the
+        # mapper input is swapped when the latest request is done
         self.point_source = vtk.vtkPointSource()
         self.point_source.SetNumberOfPoints(100)
         self.point_source.SetRadius(0.02)
         self.point_source.SetCenter(0.05, 0.0, 0.01)
 
-        self.stream_tracer = vtk.vtkStreamTracer()
-        self.stream_tracer.SetInputConnection(self.reader.GetOutputPort())
-        self.stream_tracer.SetSourceConnection(self.point_source.GetOutputPort())
-        self.stream_tracer.SetIntegratorTypeToRungeKutta45()
-        self.stream_tracer.SetMaximumPropagation(1.0) 
+        self.trace_signal = TraceSignal()
+        self.trace_signal.traced.connect(self.show_streamlines)
+        self.parallel_tracer = None
+        if self.args.workers > 1:
+            self.parallel_tracer = ParallelStreamTracer(self.args.i, self.args.resample, self.args.workers)
+        self.stream_worker = StreamlineWorker(self.reader.GetOutput(), self.trace_signal.traced.emit,
+                                              parallel_tracer=self.parallel_tracer)
+        self.stream_worker.start()
+        self.last_request = 0
 
         # Streamline mapper
         stream_mapper = vtk.vtkDataSetMapper()
-        stream_mapper.SetInputConnection(self.stream_tracer.GetOutputPort())
+        stream_mapper.SetInputData(vtk.vtkPolyData())
         stream_mapper.SetScalarModeToUsePointFieldData()
         stream_mapper.SelectColorArray("velocity")
         stream_mapper.SetScalarRange(
@@ -77,6 +88,7 @@ class InteractiveSeedingUI(QMainWindow):
 
         self.stream_actor = vtk.vtkActor()
         self.stream_actor.SetMapper(stream_mapper)
+        self.stream_mapper = stream_mapper
 
         # Pressure isosurface
         pressure_range = self.reader.GetOutput().GetPointData().GetArray("pressure").GetRange()
@@ -116,7 +128,9 @@ class InteractiveSeedingUI(QMainWindow):
         self.sphere_widget.SetRadius(self.point_source.GetRadius())
         
         # Add observer for interaction events
+        # fast preview while dragging, full quality once released
         self.sphere_widget.AddObserver("InteractionEvent", self.update_seed_source)
+        self.sphere_widget.AddObserver("EndInteractionEvent", self.update_seed_source)
         self.sphere_widget.On()
 
     def setup_sliders(self):
@@ -131,19 +145,58 @@ class InteractiveSeedingUI(QMainWindow):
         # Update point source from sphere widget
         self.point_source.SetCenter(self.sphere_widget.GetCenter())
         self.point_source.SetRadius(self.sphere_widget.GetRadius())
-        self.update_streamlines()
+        self.update_streamlines(preview=(event == "InteractionEvent"))
 
     def update_seed_count(self, value):
         self.point_source.SetNumberOfPoints(value)
         self.update_streamlines()
 
-    def update_streamlines(self):
+    '''
+    Preview requests trace fewer, shorter streamlines (optionally with RK2)
+    so that they keep up with the interaction
+    '''
+    def update_streamlines(self, preview=False):
+        request = {
+            'center': self.point_source.GetCenter(),
+            'radius': self.point_source.GetRadius(),
+            'npoints': self.point_source.GetNumberOfPoints(),
+            'propagation': self.args.propagation,
+            'seeding': self.args.seeding,
+            'seed': self.args.seeding_seed }
+        if preview:
+            request['npoints'] = min(request['npoints'], self.args.preview_seeds)
+            request['propagation'] = self.args.preview_propagation
+            if self.args.preview_rk2:
+                request['integrator'] = 'rk2'
+        self.last_request = self.stream_worker.submit(request)
+
+    def show_streamlines(self, streamlines, request_id):
+        # results of superseded requests may still be queued in the event loop
+        if request_id != self.last_request:
+            return
+        self.stream_mapper.SetInputData(streamlines)
         self.vtkWidget.GetRenderWindow().Render()
 
+    def closeEvent(self, event):
+        self.stream_worker.stop()
+        if self.parallel_tracer is not None:
+            self.parallel_tracer.close()
+        QMainWindow.closeEvent(self, event)
+
 def get_program_parameters():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", type=str, help="path to vfem.vtu file")
     parser.add_argument("-g", type=str, help="path to wing.vtp file")
+    parser.add_argument("--resample", type=int, nargs=3, metavar=("NX", "NY", "NZ"),
+                        help="run on a cached resampling of vfem.vtu on a regular grid (see resample_vfem.py)")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of streamline tracing processes")
+    parser.add_argument("--propagation", type=float, default=1.0, help="maximum streamline propagation")
+    parser.add_argument("--seeding", choices=["random", "lattice"], default="random",
+                        help="random seeds, or deterministic lattice seeds whose streamlines are cached")
+    parser.add_argument("--seeding-seed", type=int, default=0, help="random seed of the lattice seeding")
+    parser.add_argument("--preview-seeds", type=int, default=50, help="maximum number of seeds while dragging the sphere")
+    parser.add_argument("--preview-propagation", type=float, default=0.25, help="maximum streamline propagation while dragging the sphere")
+    parser.add_argument("--preview-rk2", action="store_true", help="integrate with RK2 instead of RK45 while dragging the sphere")
     return parser.parse_args()
 
 if __name__ == "__main__":
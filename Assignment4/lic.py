@@ -1,7 +1,108 @@
 import vtk
 import argparse
-
-def create_lic_plane(x_pos, wing_bounds, vector_source, y_res=500, z_res=500):
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from vtk.util import numpy_support as nps
+from probe_helper import SharedProbe
+from resample_vfem import open_vfem
+
+'''
+CPU line integral convolution. All the pixels of a tile are advected in
+lockstep: each step updates the positions of every streamline at once with
+numpy arrays, and accumulates the kernel-weighted noise values they cross.
+Streamlines stop where the field vanishes or leaves the image
+'''
+
+def make_noise(shape, seed=0):
+    return np.random.default_rng(seed).random(shape, dtype=np.float32)
+
+# Weights of the samples at offsets -steps..steps along the streamline
+def lic_kernel(steps, kind='hann'):
+    if kind == 'box':
+        return np.ones(2*steps+1, dtype=np.float32)
+    elif kind == 'hann':
+        return np.hanning(2*steps+3)[1:-1].astype(np.float32)
+    raise ValueError(f'Unknown LIC kernel: {kind}')
+
+# Bilinear interpolation of field (ny, nx, ncomp) at positions (n, 2) given as (x, y)
+def bilinear(field, pos):
+    ny, nx = field.shape[:2]
+    flat = field.reshape((ny*nx, -1))
+    x = np.clip(pos[:, 0], 0, nx-1)
+    y = np.clip(pos[:, 1], 0, ny-1)
+    i = np.minimum(x.astype(np.int32), nx-2)
+    j = np.minimum(y.astype(np.int32), ny-2)
+    u = (x - i)[:, np.newaxis]
+    v = (y - j)[:, np.newaxis]
+    k = j*nx + i
+    return (1-v)*((1-u)*flat[k] + u*flat[k+1]) + v*((1-u)*flat[k+nx] + u*flat[k+nx+1])
+
+def lic_tile(directions, noise, kernel, step_size, rows, cols):
+    ny, nx = noise.shape
+    flat_noise = noise.ravel()
+    steps = len(kernel)//2
+    jj, ii = np.meshgrid(np.arange(*rows), np.arange(*cols), indexing='ij')
+    start = np.stack([ii.ravel(), jj.ravel()], axis=-1).astype(np.float32)
+    total = kernel[steps] * noise[jj.ravel(), ii.ravel()]
+    weights = np.full(start.shape[0], kernel[steps], dtype=np.float32)
+    for sign in [ 1, -1 ]:
+        pos = start.copy()
+        alive = np.arange(start.shape[0])
+        for s in range(1, steps+1):
+            d = bilinear(directions, pos)
+            pos += (sign*step_size)*d
+            keep = ((d[:, 0] != 0) | (d[:, 1] != 0)) & \
+                   (pos[:, 0] >= 0) & (pos[:, 0] <= nx-1) & (pos[:, 1] >= 0) & (pos[:, 1] <= ny-1)
+            if not np.all(keep):
+                pos = pos[keep]
+                alive = alive[keep]
+                if alive.size == 0:
+                    break
+            w = kernel[steps + sign*s]
+            pixels = np.rint(pos).astype(np.int32)
+            total[alive] += w * flat_noise[pixels[:, 1]*nx + pixels[:, 0]]
+            weights[alive] += w
+    return (total/weights).reshape(jj.shape)
+
+'''
+LIC image of a 2D vector field (ny, nx, 2) given in pixel units. Tiles of
+tile x tile pixels are processed by nthreads threads (numpy releases the
+GIL in its array operations). The result is contrast stretched to [0, 1]
+'''
+def compute_lic(vectors, noise, steps=100, step_size=0.5, kernel='hann', nthreads=1, tile=128):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    directions = np.divide(vectors, norms, out=np.zeros_like(vectors, dtype=np.float32), where=norms > 0)
+    weights = lic_kernel(steps, kernel)
+    ny, nx = noise.shape
+    tiles = [ ((j, min(j+tile, ny)), (i, min(i+tile, nx))) for j in range(0, ny, tile) for i in range(0, nx, tile) ]
+    image = np.zeros((ny, nx), dtype=np.float32)
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        results = executor.map(lambda t: lic_tile(directions, noise, weights, step_size, *t), tiles)
+        for (rows, cols), values in zip(tiles, results):
+            image[rows[0]:rows[1], cols[0]:cols[1]] = values
+    lo, hi = np.percentile(image, [1, 99])
+    return np.clip((image - lo)/max(hi - lo, 1.0e-6), 0, 1)
+
+'''
+numpy counterpart of vtkImageDataLIC2D for the probed (1, y_res, z_res)
+image, using the in-plane (y, z) components of its vectors. The output
+image has the same points and a single LIC scalar
+'''
+def numpy_lic(probed, noise, steps=100, step_size=0.5, kernel='hann', nthreads=1):
+    _, y_res, z_res = probed.GetDimensions()
+    spacing = probed.GetSpacing()
+    vectors = nps.vtk_to_numpy(probed.GetPointData().GetVectors()).reshape((z_res, y_res, 3))
+    vectors = vectors[:, :, 1:] / np.array(spacing[1:], dtype=np.float32)
+    values = compute_lic(vectors, noise, steps, step_size, kernel, nthreads)
+
+    output = vtk.vtkImageData()
+    output.SetDimensions(y_res, z_res, 1)
+    array = nps.numpy_to_vtk(values.ravel())
+    array.SetName('LIC')
+    output.GetPointData().SetScalars(array)
+    return output
+
+def create_lic_grid(x_pos, wing_bounds, y_res=500, z_res=500):
     image = vtk.vtkImageData()
     image.SetDimensions(1, y_res, z_res)
     
@@ -17,30 +118,41 @@ def create_lic_plane(x_pos, wing_bounds, vector_source, y_res=500, z_res=500):
     origin = (x_pos, y_min, z_min)
     image.SetSpacing(spacing)
     image.SetOrigin(origin)
-
-    num_points = image.GetNumberOfPoints()
-    pressure_array = vtk.vtkFloatArray()
-    pressure_array.SetName("pressure")
-    pressure_array.SetNumberOfComponents(3)
-    pressure_array.SetNumberOfTuples(num_points)
-    for i in range(num_points):
-        pressure_array.SetTuple3(i, 0, 0, 0)
-    image.GetPointData().SetVectors(pressure_array)
-
-
-
-    probe = vtk.vtkProbeFilter()
-    probe.SetInputData(image)
-    probe.SetSourceConnection(vector_source.GetOutputPort())
+    return image
+
+'''
+LIC texture on the plane x = x_pos. The grid is probed against
+vector_source unless it was already probed (e.g. by a SharedProbe
+together with the other planes), in which case it is passed as probed
+'''
+def create_lic_plane(x_pos, wing_bounds, vector_source, y_res=500, z_res=500, engine='vtk', noise=None,
+                     steps=100, step_size=0.5, kernel='hann', nthreads=1, probed=None):
+    if probed is None:
+        # the image geometry is implicit and the probe output only carries
+        # the arrays of the source, so no point arrays are needed on the input
+        probe = vtk.vtkProbeFilter()
+        probe.SetInputData(create_lic_grid(x_pos, wing_bounds, y_res, z_res))
+        probe.SetSourceConnection(vector_source.GetOutputPort())
+        probe.Update()
+        probed = probe.GetOutput()
+    _, y_res, z_res = probed.GetDimensions()
+    y_min, y_max = probed.GetBounds()[2:4]
+    z_min, z_max = probed.GetBounds()[4:6]
     
-    lic = vtk.vtkImageDataLIC2D()
-    lic.SetInputConnection(probe.GetOutputPort())
-    lic.SetSteps(100)                # Number of integration steps
-    lic.SetStepSize(0.5)          # Step size as fraction of domain
-    lic.Update()
+    if engine == 'numpy':
+        if noise is None:
+            noise = make_noise((z_res, y_res))
+        lic_image = numpy_lic(probed, noise, steps, step_size, kernel, nthreads)
+    else:
+        lic = vtk.vtkImageDataLIC2D()
+        lic.SetInputData(probed)
+        lic.SetSteps(steps)                # Number of integration steps
+        lic.SetStepSize(step_size)          # Step size as fraction of domain
+        lic.Update()
+        lic_image = lic.GetOutput()
 
     plane = vtk.vtkPlaneSource()
-    plane.SetOrigin(image.GetOrigin())
+    plane.SetOrigin(probed.GetOrigin())
     plane.SetPoint1(x_pos, y_max, z_min)
     plane.SetPoint2(x_pos, y_min, z_max)
     plane.SetResolution(1, 1)
@@ -54,7 +166,7 @@ def create_lic_plane(x_pos, wing_bounds, vector_source, y_res=500, z_res=500):
 
     map_to_gray = vtk.vtkImageMapToColors()
     map_to_gray.SetLookupTable(lut)
-    map_to_gray.SetInputConnection(lic.GetOutputPort())
+    map_to_gray.SetInputData(lic_image)
     map_to_gray.Update()
 
     texture = vtk.vtkTexture()
@@ -76,11 +188,20 @@ def main():
                       help="Path to vector field VTU file")
     parser.add_argument("-g", "--geometry", required=True,
                       help="Path to wing geometry VTP file")
+    parser.add_argument("--engine", choices=["vtk", "numpy"], default="vtk",
+                      help="LIC implementation: vtkImageDataLIC2D (OpenGL) or numpy (CPU)")
+    parser.add_argument("--kernel", choices=["box", "hann"], default="hann",
+                      help="Convolution kernel of the numpy LIC")
+    parser.add_argument("--steps", type=int, default=100, help="Number of integration steps")
+    parser.add_argument("--step-size", type=float, default=0.5, help="Integration step size")
+    parser.add_argument("--threads", type=int, default=1, help="Threads of the numpy LIC")
+    parser.add_argument("--y-res", type=int, default=500, help="LIC plane resolution along y")
+    parser.add_argument("--z-res", type=int, default=500, help="LIC plane resolution along z")
+    parser.add_argument("--resample", type=int, nargs=3, metavar=("NX", "NY", "NZ"),
+                      help="run on a cached resampling of vfem.vtu on a regular grid (see resample_vfem.py)")
     args = parser.parse_args()
 
-    vfem_reader = vtk.vtkXMLUnstructuredGridReader()
-    vfem_reader.SetFileName(args.input)
-    vfem_reader.Update()
+    vfem_reader = open_vfem(args.input, args.resample)
     wing_reader = vtk.vtkXMLPolyDataReader()
     wing_reader.SetFileName(args.geometry)
     wing_reader.Update()
@@ -94,9 +215,18 @@ def main():
 
     plane_positions = [0.1, 0.3, 0.5]
 
+    # all the planes are probed at once with a single cell locator
+    grids = [ create_lic_grid(x, wing_bounds, args.y_res, args.z_res) for x in plane_positions ]
+    probed_grids = SharedProbe(vfem_reader.GetOutput()).probe(*grids)
+
+    # same noise texture for all the planes
+    noise = make_noise((args.z_res, args.y_res)) if args.engine == "numpy" else None
     lic_actors = []
-    for x in plane_positions:
-        lic_actors.append( create_lic_plane(x, wing_bounds, vfem_reader) )
+    for x, probed in zip(plane_positions, probed_grids):
+        lic_actors.append( create_lic_plane(x, wing_bounds, vfem_reader, args.y_res, args.z_res,
+                                            engine=args.engine, noise=noise,
+                                            steps=args.steps, step_size=args.step_size,
+                                            kernel=args.kernel, nthreads=args.threads, probed=probed) )
     
     renderer = vtk.vtkRenderer()
     renderer.AddActor(wing_actor)
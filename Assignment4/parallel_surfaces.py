@@ -0,0 +1,139 @@
+import vtk
+import multiprocessing
+import numpy as np
+# registers the pickling of the vtkPolyData returned by the workers
+import vtkmodules.util.pickle_support
+import parallel_tracer
+from parallel_tracer import init_worker, make_tracer, seed_polydata
+from resample_vfem import open_vfem
+from stream_worker import split_by_seed
+
+'''
+Stream surfaces of several seed rakes (line segments), one vtkStreamSurface
+per rake, built in parallel in a process pool whose workers load the CFD
+field once (see parallel_tracer), then appended in rake order.
+
+Rakes are seeded either uniformly or adaptively: starting from a coarse
+rake, a seed is inserted halfway between two neighboring seeds whenever
+their streamlines diverge, i.e. when their largest distance at equal
+integration times exceeds `divergence` times their distance on the rake.
+Seeds are inserted until no neighbors diverge, the gap between them would
+become smaller than the spacing of a uniform rake of max_seeds seeds, or
+the rake has max_seeds seeds.
+'''
+
+def rake_points(point1, point2, params):
+    point1, point2 = np.asarray(point1, dtype=float), np.asarray(point2, dtype=float)
+    return point1 + np.asarray(params)[:, None]*(point2 - point1)
+
+# Rake of the given seed points, as a polyline like the output of vtkLineSource
+def rake_polydata(points):
+    rake = seed_polydata(points)
+    line = vtk.vtkPolyLine()
+    line.GetPointIds().SetNumberOfIds(points.shape[0])
+    for i in range(points.shape[0]):
+        line.GetPointIds().SetId(i, i)
+    lines = vtk.vtkCellArray()
+    lines.InsertNextCell(line)
+    rake.SetLines(lines)
+    return rake
+
+'''
+Forward and backward trajectories of the seeds (absolute integration times
+and points). A pass without a line is the seed point itself
+'''
+def trace_trajectories(dataset, points, settings):
+    # vtkStreamSurface settings that vtkStreamTracer does not have are ignored
+    settings = { name: value for name, value in settings.items() if hasattr(vtk.vtkStreamTracer, 'Set' + name) }
+    tracer = make_tracer(dataset, settings)
+    tracer.SetSourceData(seed_polydata(points))
+    tracer.Update()
+    by_seed = split_by_seed(tracer.GetOutput())
+    trajectories = []
+    for i, point in enumerate(points):
+        seed = { 1: (np.zeros(1), point[None]), -1: (np.zeros(1), point[None]) }
+        entry = by_seed.get(i, { 'points': [], 'arrays': { 'IntegrationTime': [] } })
+        for line, time in zip(entry['points'], entry['arrays']['IntegrationTime']):
+            seed[-1 if time[-1] < 0 else 1] = (np.abs(time), line)
+        trajectories.append(seed)
+    return trajectories
+
+# Largest distance between two trajectories at equal times, a stopped trajectory staying at its end
+def separation(a, b, num_samples=64):
+    distance = 0
+    for direction in a:
+        (time_a, points_a), (time_b, points_b) = a[direction], b[direction]
+        t = np.linspace(0, max(time_a[-1], time_b[-1]), num_samples)
+        pa = np.stack([ np.interp(t, time_a, points_a[:, k]) for k in range(3) ], axis=-1)
+        pb = np.stack([ np.interp(t, time_b, points_b[:, k]) for k in range(3) ], axis=-1)
+        distance = max(distance, np.max(np.linalg.norm(pa - pb, axis=-1)))
+    return distance
+
+# Parameters in [0, 1] of the adaptive seeds along the rake (see the module docstring)
+def refine_rake(dataset, point1, point2, settings, max_seeds=401, initial_seeds=25, divergence=2.0):
+    # no seed can be inserted between the two ends
+    if max_seeds <= 2:
+        return np.linspace(0, 1, max_seeds)
+    params = np.linspace(0, 1, min(initial_seeds, max_seeds))
+    trajectories = trace_trajectories(dataset, rake_points(point1, point2, params), settings)
+    rake_length = np.linalg.norm(np.subtract(point2, point1))
+    min_gap = 2.0/(max_seeds - 1)
+    while len(params) < max_seeds:
+        gaps = np.diff(params)
+        ratios = np.array([ separation(trajectories[i], trajectories[i+1])/(gaps[i]*rake_length) for i in range(len(gaps)) ])
+        split = np.nonzero((ratios > divergence) & (gaps >= min_gap))[0]
+        if len(split) == 0:
+            break
+        # the most divergent first when the seed budget runs out
+        split = np.sort(split[np.argsort(-ratios[split], kind='stable')][:max_seeds - len(params)])
+        new_params = params[split] + gaps[split]/2
+        new_trajectories = trace_trajectories(dataset, rake_points(point1, point2, new_params), settings)
+        order = np.argsort(np.concatenate([ params, new_params ]), kind='stable')
+        params = np.concatenate([ params, new_params ])[order]
+        trajectories = [ (trajectories + new_trajectories)[i] for i in order ]
+    return params
+
+'''
+Stream surface of one rake with num_seeds uniform seeds, or adaptive seeds
+if refinement (keyword arguments of refine_rake other than max_seeds) is
+given. Returns the surface and its number of seeds
+'''
+def build_rake_surface(dataset, point1, point2, num_seeds, refinement, settings):
+    if refinement is None:
+        params = np.linspace(0, 1, num_seeds)
+    else:
+        params = refine_rake(dataset, point1, point2, settings, max_seeds=num_seeds, **refinement)
+    surface = make_tracer(dataset, settings, vtk.vtkStreamSurface)
+    surface.SetSourceData(rake_polydata(rake_points(point1, point2, params)))
+    surface.Update()
+    output = vtk.vtkPolyData()
+    output.ShallowCopy(surface.GetOutput())
+    return output, len(params)
+
+def rake_surface(task):
+    return build_rake_surface(parallel_tracer._dataset, *task)
+
+'''
+Stream surfaces of the rakes (pairs of end points) in the CFD field of
+vtu_file, built with up to one worker process per rake. With a single
+worker they are built in the calling process, on dataset if it is given.
+settings are those of vtkStreamSurface (see parallel_tracer). Returns the
+appended surfaces and the number of seeds of each rake
+'''
+def stream_surfaces(vtu_file, rakes, resample=None, workers=1, num_seeds=401, refinement=None, dataset=None, **settings):
+    tasks = [ (point1, point2, num_seeds, refinement, settings) for point1, point2 in rakes ]
+    workers = min(workers, len(tasks))
+    if workers > 1:
+        # spawn: VTK objects of the parent must not be shared with forked workers
+        with multiprocessing.get_context('spawn').Pool(workers, init_worker, (vtu_file, resample)) as pool:
+            results = pool.map(rake_surface, tasks)
+    else:
+        if dataset is None:
+            dataset = open_vfem(vtu_file, resample).GetOutput()
+        results = [ build_rake_surface(dataset, *task) for task in tasks ]
+
+    append = vtk.vtkAppendPolyData()
+    for surface, _ in results:
+        append.AddInputData(surface)
+    append.Update()
+    return append.GetOutput(), [ n for _, n in results ]
@@ -0,0 +1,238 @@
+import vtk
+import multiprocessing
+import numpy as np
+from vtk.util import numpy_support as nps
+from resample_vfem import open_vfem
+
+'''
+Streamline tracing in a process pool. The seeds are split into contiguous
+partitions that are traced by vtkStreamTracer in worker processes, each of
+which loads the CFD field once when it starts. The partial outputs are
+merged in the order of the serial tracer (all the forward lines by seed,
+then all the backward lines by seed), so that the result is identical to a
+single vtkStreamTracer run over all the seeds: same lines, points and
+arrays in the same order. The only difference can come from the tracer
+starting the cell search of a seed from the cell where the previous seed
+ended: at the first seed of a partition, interpolation may then round
+differently in the last bit.
+
+Tracer settings are given by the name of their vtkStreamTracer setter
+without the Set prefix, e.g. MaximumPropagation=1.5 or IntegratorType=1.
+'''
+
+# CFD field of the worker process
+_dataset = None
+
+def init_worker(vtu_file, resample):
+    global _dataset
+    _dataset = open_vfem(vtu_file, resample).GetOutput()
+
+# A vtkStreamTracer (or subclass, e.g. vtkStreamSurface) of dataset with the given settings
+def make_tracer(dataset, settings, tracer_class=vtk.vtkStreamTracer):
+    tracer = tracer_class()
+    tracer.SetInputData(dataset)
+    for name, value in settings.items():
+        getattr(tracer, 'Set' + name)(value)
+    return tracer
+
+def seed_coords(seeds):
+    if isinstance(seeds, vtk.vtkAlgorithm):
+        seeds.Update()
+        seeds = seeds.GetOutput()
+    if isinstance(seeds, vtk.vtkDataSet):
+        if seeds.GetNumberOfPoints() == 0:
+            return np.zeros((0, 3))
+        return nps.vtk_to_numpy(seeds.GetPoints().GetData())
+    return np.asarray(seeds, dtype=float).reshape((-1, 3))
+
+def seed_polydata(coords):
+    points = vtk.vtkPoints()
+    points.SetData(nps.numpy_to_vtk(np.ascontiguousarray(coords)))
+    polydata = vtk.vtkPolyData()
+    polydata.SetPoints(points)
+    return polydata
+
+def attribute_arrays(attributes):
+    arrays = {}
+    for i in range(attributes.GetNumberOfArrays()):
+        array = attributes.GetArray(i)
+        arrays[attributes.GetArrayName(i)] = (nps.vtk_to_numpy(array), array.GetDataType())
+    active = {}
+    for attribute in range(vtk.vtkDataSetAttributes.NUM_ATTRIBUTES):
+        array = attributes.GetAttribute(attribute)
+        if array is not None:
+            active[attribute] = array.GetName()
+    return arrays, active
+
+def set_attribute_arrays(attributes, arrays, active, indices):
+    for name, (values, data_type) in arrays.items():
+        array = nps.numpy_to_vtk(values[indices], deep=True, array_type=data_type)
+        array.SetName(name)
+        attributes.AddArray(array)
+    for attribute, name in active.items():
+        attributes.SetActiveAttribute(name, attribute)
+
+# Concatenation of the index ranges [starts[i], starts[i] + sizes[i])
+def gather_ranges(starts, sizes):
+    ends = np.cumsum(sizes)
+    return np.repeat(starts - ends + sizes, sizes) + np.arange(ends[-1] if len(ends) else 0)
+
+# Picklable copy of the streamlines (vtkStreamTracer output)
+def streamline_arrays(streamlines):
+    if streamlines.GetNumberOfPoints() == 0:
+        return None
+    lines = streamlines.GetLines()
+    return {
+        'points': nps.vtk_to_numpy(streamlines.GetPoints().GetData()).copy(),
+        'offsets': nps.vtk_to_numpy(lines.GetOffsetsArray()).copy(),
+        'connectivity': nps.vtk_to_numpy(lines.GetConnectivityArray()).copy(),
+        'point_data': attribute_arrays(streamlines.GetPointData()),
+        'cell_data': attribute_arrays(streamlines.GetCellData()) }
+
+'''
+Trace the seeds [start, end) of a trace call. Both directions are traced as
+a forward then a backward pass, which is what vtkStreamTracer does
+internally, so that the pass of every output point is known. Returns the
+arrays of each pass that has output
+'''
+def trace_partition(task):
+    start, end, coords, settings = task
+    direction = settings.get('IntegrationDirection', vtk.vtkStreamTracer.FORWARD)
+    if direction == vtk.vtkStreamTracer.BOTH:
+        directions = [ vtk.vtkStreamTracer.FORWARD, vtk.vtkStreamTracer.BACKWARD ]
+    else:
+        directions = [ direction ]
+    results = []
+    for integration_pass, direction in enumerate(directions):
+        tracer = make_tracer(_dataset, { **settings, 'IntegrationDirection': direction })
+        tracer.SetSourceData(seed_polydata(coords))
+        tracer.Update()
+        data = streamline_arrays(tracer.GetOutput())
+        if data is not None:
+            results.append((integration_pass, start, end, data))
+    return results
+
+# Values of an array missing from a pass whose points are not on any line
+def unused_point_values(values, data):
+    fill = np.zeros((data['points'].shape[0],) + values.shape[1:], dtype=values.dtype)
+    # the tracer initializes the normals of all points to (1, 0, 0)
+    if fill.ndim == 2 and fill.shape[1] == 3:
+        fill[:, 0] = 1
+    return fill
+
+'''
+Merge the pass outputs of trace_partition in the order of a serial run: by
+pass, then by seed. The tracer stores the points of each line contiguously,
+after the single points left by seeds whose line was discarded, so the
+points are moved by blocks: a line with the unused points before it, and
+the unused points after the last line, which belong to later seeds of the
+partition
+'''
+def merge_partitions(results):
+    parts = [ part for partition in results for part in partition ]
+    if not parts:
+        return vtk.vtkPolyData()
+    # blocks: (pass, seed key, first point, number of points, first connectivity id, number of line points)
+    blocks, connectivities = [], []
+    num_points = num_ids = 0
+    for integration_pass, start, end, data in parts:
+        offsets, connectivity = data['offsets'], data['connectivity']
+        block_start = 0
+        ids = []
+        if 'SeedIds' in data['cell_data'][0]:
+            ids, data_type = data['cell_data'][0]['SeedIds']
+            data['cell_data'][0]['SeedIds'] = (ids + ids.dtype.type(start), data_type)
+            ids = ids.tolist()
+        for i, seed_id in enumerate(ids):
+            block_end = connectivity[offsets[i+1] - 1] + 1
+            blocks.append((integration_pass, start + seed_id, num_points + block_start, block_end - block_start,
+                           num_ids + offsets[i], offsets[i+1] - offsets[i]))
+            block_start = block_end
+        if block_start < data['points'].shape[0]:
+            blocks.append((integration_pass, end - 0.5, num_points + block_start, data['points'].shape[0] - block_start, -1, 0))
+        connectivities.append(connectivity + num_points)
+        num_points += data['points'].shape[0]
+        num_ids += len(connectivity)
+
+    blocks = np.array(blocks)
+    order = np.lexsort((blocks[:, 1], blocks[:, 0]))
+    # the cell arrays are concatenated in block order
+    has_line = blocks[:, 4] >= 0
+    cell_ids = (np.cumsum(has_line) - 1)[order][has_line[order]]
+    blocks = blocks[order].astype(np.int64)
+    # point_ids[new id] = id in the concatenated partition points
+    point_ids = gather_ranges(blocks[:, 2], blocks[:, 3])
+    new_ids = np.empty(num_points, dtype=np.int64)
+    new_ids[point_ids] = np.arange(num_points)
+    line_blocks = blocks[has_line[order]]
+    offsets = np.zeros(line_blocks.shape[0] + 1, dtype=np.int64)
+    np.cumsum(line_blocks[:, 5], out=offsets[1:])
+    connectivity = np.concatenate(connectivities)
+
+    output = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(nps.numpy_to_vtk(np.concatenate([ data['points'] for *_, data in parts ])[point_ids], deep=True))
+    output.SetPoints(points)
+    lines = vtk.vtkCellArray()
+    lines.SetData(nps.numpy_to_vtk(offsets, deep=True),
+                  nps.numpy_to_vtk(new_ids[connectivity[gather_ranges(line_blocks[:, 4], line_blocks[:, 5])]], deep=True))
+    output.SetLines(lines)
+    # passes without lines have no cell arrays and no normals
+    reference = next((data for *_, data in parts if len(data['offsets']) > 1), parts[0][3])
+    for attributes, key, indices in [ (output.GetPointData(), 'point_data', point_ids), (output.GetCellData(), 'cell_data', cell_ids) ]:
+        arrays, active = reference[key]
+        arrays = { name: (np.concatenate([ data[key][0][name][0] if name in data[key][0] else unused_point_values(values, data)
+                                           for *_, data in parts if key == 'point_data' or len(data['offsets']) > 1 ]), data_type)
+                   for name, (values, data_type) in arrays.items() }
+        set_attribute_arrays(attributes, arrays, active, indices)
+    return output
+
+'''
+Tracer of the CFD field of vtu_file (or of its resampling, see open_vfem)
+with the given number of worker processes. The seeds of each trace call are
+split into partitions, one per worker by default. With a single worker the
+seeds are traced in the calling process, on dataset if it is given
+'''
+class ParallelStreamTracer:
+    def __init__(self, vtu_file, resample=None, workers=1, partitions=None, dataset=None, **settings):
+        self.vtu_file = vtu_file
+        self.resample = resample
+        self.workers = max(1, workers)
+        self.partitions = partitions or self.workers
+        self.dataset = dataset
+        self.settings = settings
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def trace_serial(self, coords, settings):
+        if self.dataset is None:
+            self.dataset = open_vfem(self.vtu_file, self.resample).GetOutput()
+        tracer = make_tracer(self.dataset, settings)
+        tracer.SetSourceData(seed_polydata(coords))
+        tracer.Update()
+        output = vtk.vtkPolyData()
+        output.ShallowCopy(tracer.GetOutput())
+        return output
+
+    # Streamlines of the seeds (a dataset, algorithm or array of points), with settings overriding those of the tracer
+    def trace(self, seeds, **settings):
+        coords = seed_coords(seeds)
+        settings = { **self.settings, **settings }
+        if self.workers == 1 or coords.shape[0] < 2:
+            return self.trace_serial(coords, settings)
+        if self.pool is None:
+            # spawn: VTK objects of the parent must not be shared with forked workers
+            self.pool = multiprocessing.get_context('spawn').Pool(self.workers, init_worker, (self.vtu_file, self.resample))
+        bounds = np.linspace(0, coords.shape[0], min(self.partitions, coords.shape[0]) + 1).astype(int)
+        tasks = [ (start, end, coords[start:end], settings) for start, end in zip(bounds[:-1], bounds[1:]) ]
+        return merge_partitions(self.pool.map(trace_partition, tasks))
@@ -0,0 +1,82 @@
+import vtk
+import numpy as np
+from vtk.util import numpy_support as nps
+
+'''
+Probing of a single source dataset (e.g. vfem.vtu) at the points of many
+datasets. The static cell locator of the source is built once and reused
+by every probe, and all the datasets passed to one probe call are
+resampled together in a single vtkProbeFilter pass.
+'''
+
+# Point coordinates, in point id order. Those of images are computed from
+# the indices of their extent (which need not start at 0) with the index to
+# physical matrix, i.e. origin, spacing and direction
+def dataset_points(dataset):
+    if isinstance(dataset, vtk.vtkImageData):
+        x0, x1, y0, y1, z0, z1 = dataset.GetExtent()
+        k, j, i = np.meshgrid(np.arange(z0, z1+1), np.arange(y0, y1+1), np.arange(x0, x1+1), indexing='ij')
+        indices = np.stack([ i.ravel(), j.ravel(), k.ravel(), np.ones(i.size) ], axis=-1)
+        matrix = dataset.GetIndexToPhysicalMatrix()
+        matrix = np.array([ [ matrix.GetElement(r, c) for c in range(4) ] for r in range(3) ])
+        return indices @ matrix.T
+    return nps.vtk_to_numpy(dataset.GetPoints().GetData())
+
+class SharedProbe:
+    def __init__(self, source):
+        if isinstance(source, vtk.vtkAlgorithm):
+            source.Update()
+            source = source.GetOutput()
+        self.source = source
+        self.locator = None
+        # cells of images are found in constant time without a locator
+        if not isinstance(source, vtk.vtkImageData):
+            self.locator = vtk.vtkStaticCellLocator()
+            self.locator.SetDataSet(source)
+            self.locator.BuildLocator()
+
+    def make_probe(self):
+        probe = vtk.vtkProbeFilter()
+        probe.SetSourceData(self.source)
+        if self.locator is None:
+            return probe
+        strategy = vtk.vtkCellLocatorStrategy()
+        strategy.SetCellLocator(self.locator)
+        probe.SetFindCellStrategy(strategy)
+        return probe
+
+    '''
+    Resample the source at the points of all the datasets (planes, images or
+    point sets) at once. Returns one copy of each dataset carrying the probed
+    point arrays
+    '''
+    def probe(self, *datasets):
+        coords = [ dataset_points(dataset) for dataset in datasets ]
+        points = vtk.vtkPoints()
+        points.SetData(nps.numpy_to_vtk(np.concatenate(coords)))
+        all_points = vtk.vtkPolyData()
+        all_points.SetPoints(points)
+
+        probe = self.make_probe()
+        probe.SetInputData(all_points)
+        probe.Update()
+        probed_data = probe.GetOutput().GetPointData()
+
+        outputs = []
+        start = 0
+        for dataset, c in zip(datasets, coords):
+            output = dataset.NewInstance()
+            output.CopyStructure(dataset)
+            point_data = output.GetPointData()
+            for i in range(probed_data.GetNumberOfArrays()):
+                values = nps.vtk_to_numpy(probed_data.GetArray(i))[start:start+c.shape[0]]
+                array = nps.numpy_to_vtk(values, array_type=probed_data.GetArray(i).GetDataType())
+                array.SetName(probed_data.GetArrayName(i))
+                point_data.AddArray(array)
+            for attribute in [ vtk.vtkDataSetAttributes.SCALARS, vtk.vtkDataSetAttributes.VECTORS ]:
+                array = probed_data.GetAttribute(attribute)
+                if array is not None:
+                    point_data.SetActiveAttribute(array.GetName(), attribute)
+            outputs.append(output)
+            start += c.shape[0]
+        return outputs
@@ -0,0 +1,231 @@
+import vtk
+import threading
+from collections import OrderedDict
+import numpy as np
+from vtk.util import numpy_support as nps
+
+# vtkStreamTracer integrator types
+INTEGRATORS = { 'rk2': 0, 'rk4': 1, 'rk45': 2 }
+
+# splitmix64 finalizer, applied elementwise to uint64 arrays
+def splitmix64(z):
+    z = z + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+# count reproducible uniform numbers in [0, 1) per integer lattice cell (n, 3)
+def cell_random(cells, seed, count):
+    c = cells.astype(np.uint64)
+    h = (c[:, 0] * np.uint64(0x9E3779B97F4A7C15)) ^ (c[:, 1] * np.uint64(0xC2B2AE3D27D4EB4F)) ^ \
+        (c[:, 2] * np.uint64(0x165667B19E3779F9)) ^ np.uint64(seed)
+    values = []
+    for _ in range(count):
+        h = splitmix64(h)
+        values.append((h >> np.uint64(11)).astype(np.float64) * 2.0**-53)
+    return np.stack(values, axis=-1)
+
+'''
+Deterministic seeds in a sphere: one randomly jittered point per cell of a
+world-anchored lattice, keeping the npoints points of lowest random
+priority. The lattice spacing is a power of two, so that moving or slightly
+resizing the sphere keeps most seeds exactly where they were. Returns the
+seed keys (lattice level and cell) and positions, none for an empty
+sphere or no points
+'''
+def lattice_seeds(center, radius, npoints, seed=0):
+    if npoints <= 0 or radius <= 0:
+        return [], np.zeros((0, 3))
+    center = np.asarray(center, dtype=float)
+    volume = 4/3*np.pi*radius**3
+    level = int(np.floor(np.log2(np.cbrt(volume/npoints))))
+    h = 2.0**level
+    lo = np.floor((center - radius)/h).astype(np.int64)
+    hi = np.floor((center + radius)/h).astype(np.int64)
+    cells = np.stack(np.meshgrid(*[ np.arange(l, u+1) for l, u in zip(lo, hi) ], indexing='ij'), axis=-1).reshape((-1, 3))
+    random = cell_random(cells, seed, 4)
+    points = (cells + random[:, :3]) * h
+    inside = np.sum(np.square(points - center), axis=-1) <= radius**2
+    cells, points, priority = cells[inside], points[inside], random[inside, 3]
+    order = np.argsort(priority, kind='stable')[:npoints]
+    keys = [ (level,) + tuple(c) for c in cells[order].tolist() ]
+    return keys, points[order]
+
+'''
+Split the output of vtkStreamTracer by seed: for each seed index, the
+points, line sizes and point arrays of its streamlines
+'''
+def split_by_seed(streamlines):
+    lines = streamlines.GetLines()
+    if lines.GetNumberOfCells() == 0:
+        return {}
+    offsets = nps.vtk_to_numpy(lines.GetOffsetsArray())
+    connectivity = nps.vtk_to_numpy(lines.GetConnectivityArray())
+    seed_ids = nps.vtk_to_numpy(streamlines.GetCellData().GetArray('SeedIds'))
+    points = nps.vtk_to_numpy(streamlines.GetPoints().GetData())
+    point_data = streamlines.GetPointData()
+    arrays = { point_data.GetArrayName(i): nps.vtk_to_numpy(point_data.GetArray(i)) for i in range(point_data.GetNumberOfArrays()) }
+    by_seed = {}
+    for cell, seed_id in enumerate(seed_ids.tolist()):
+        ids = connectivity[offsets[cell]:offsets[cell+1]]
+        entry = by_seed.setdefault(seed_id, { 'points': [], 'sizes': [], 'arrays': { name: [] for name in arrays } })
+        entry['points'].append(points[ids])
+        entry['sizes'].append(len(ids))
+        for name, values in arrays.items():
+            entry['arrays'][name].append(values[ids])
+    return by_seed
+
+# Polydata of the streamlines of cache entries (see split_by_seed)
+def assemble_streamlines(entries):
+    entries = [ e for e in entries if e['sizes'] ]
+    output = vtk.vtkPolyData()
+    if not entries:
+        return output
+    points = vtk.vtkPoints()
+    points.SetData(nps.numpy_to_vtk(np.concatenate([ p for e in entries for p in e['points'] ])))
+    output.SetPoints(points)
+    sizes = np.array([ n for e in entries for n in e['sizes'] ], dtype=np.int64)
+    offsets = np.zeros(len(sizes)+1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    lines = vtk.vtkCellArray()
+    lines.SetData(nps.numpy_to_vtk(offsets), nps.numpy_to_vtk(np.arange(offsets[-1], dtype=np.int64)))
+    output.SetLines(lines)
+    for name in entries[0]['arrays']:
+        array = nps.numpy_to_vtk(np.concatenate([ a for e in entries for a in e['arrays'][name] ]))
+        array.SetName(name)
+        output.GetPointData().AddArray(array)
+    return output
+
+'''
+Streamline tracing in a background thread with a latest-request-wins policy.
+Each new request supersedes the previous one: a request still waiting is
+dropped, and the one being traced is abandoned at the next chunk boundary
+(seeds are traced chunk_size at a time). Finished traces are handed to the
+callback together with their request id, from the worker thread.
+
+Requests with 'lattice' seeding use lattice_seeds and keep the streamlines
+of up to cache_size seeds, so that only the seeds that were not traced
+before with the same parameters are integrated. With a ParallelStreamTracer,
+each chunk is split between its worker processes.
+'''
+class StreamlineWorker(threading.Thread):
+    def __init__(self, dataset, callback, chunk_size=50, cache_size=20000, parallel_tracer=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.dataset = dataset
+        self.callback = callback
+        self.chunk_size = chunk_size
+        self.condition = threading.Condition()
+        self.request = None
+        self.request_id = 0
+        self.running = True
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+        self.tracer = vtk.vtkStreamTracer()
+        self.tracer.SetInputData(dataset)
+        self.parallel_tracer = parallel_tracer
+        if parallel_tracer is not None:
+            # chunk_size seeds per worker
+            self.chunk_size = chunk_size * parallel_tracer.workers
+
+    '''
+    Queue a request (a dict with the seed center, radius and number of
+    points, the maximum propagation and optionally the integrator, RK45 by
+    default, and the seeding, 'random' or 'lattice' with a given 'seed')
+    and return its id
+    '''
+    def submit(self, request):
+        with self.condition:
+            self.request_id += 1
+            self.request = (self.request_id, request)
+            self.condition.notify()
+            return self.request_id
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def cancelled(self, request_id):
+        return request_id != self.request_id or not self.running
+
+    def seeds(self, request):
+        source = vtk.vtkPointSource()
+        source.SetCenter(request['center'])
+        source.SetRadius(request['radius'])
+        source.SetNumberOfPoints(request['npoints'])
+        source.Update()
+        return nps.vtk_to_numpy(source.GetOutput().GetPoints().GetData())
+
+    # Trace the seeds chunk_size at a time, stopping if the request is superseded
+    def trace_chunks(self, request_id, seeds):
+        for start in range(0, seeds.shape[0], self.chunk_size):
+            if self.cancelled(request_id):
+                return
+            if self.parallel_tracer is not None:
+                yield start, self.parallel_tracer.trace(seeds[start:start+self.chunk_size],
+                                                        MaximumPropagation=self.tracer.GetMaximumPropagation(),
+                                                        IntegratorType=self.tracer.GetIntegratorType())
+                continue
+            points = vtk.vtkPoints()
+            points.SetData(nps.numpy_to_vtk(np.ascontiguousarray(seeds[start:start+self.chunk_size])))
+            chunk = vtk.vtkPolyData()
+            chunk.SetPoints(points)
+            self.tracer.SetSourceData(chunk)
+            self.tracer.Update()
+            lines = vtk.vtkPolyData()
+            lines.ShallowCopy(self.tracer.GetOutput())
+            yield start, lines
+
+    # Streamlines of the request, or None if it was superseded while tracing
+    def trace(self, request_id, request):
+        self.tracer.SetMaximumPropagation(request['propagation'])
+        self.tracer.SetIntegratorType(INTEGRATORS[request.get('integrator', 'rk45')])
+        if request.get('seeding', 'random') == 'lattice':
+            return self.trace_cached(request_id, request)
+        seeds = self.seeds(request)
+        if seeds.shape[0] == 0:
+            return vtk.vtkPolyData()
+        append = vtk.vtkAppendPolyData()
+        for _, lines in self.trace_chunks(request_id, seeds):
+            append.AddInputData(lines)
+        if self.cancelled(request_id):
+            return None
+        append.Update()
+        return append.GetOutput()
+
+    def trace_cached(self, request_id, request):
+        params = (request['propagation'], request.get('integrator', 'rk45'))
+        keys, seeds = lattice_seeds(request['center'], request['radius'], request['npoints'], request.get('seed', 0))
+        new = [ i for i, key in enumerate(keys) if (params, key) not in self.cache ]
+        # completed chunks are kept even if the request gets superseded
+        empty = { 'points': [], 'sizes': [], 'arrays': {} }
+        for start, lines in self.trace_chunks(request_id, seeds[new]):
+            by_seed = split_by_seed(lines)
+            for i in range(min(self.chunk_size, len(new) - start)):
+                self.cache[(params, keys[new[start+i]])] = by_seed.get(i, empty)
+        cancelled = self.cancelled(request_id)
+        entries = []
+        if not cancelled:
+            for key in keys:
+                self.cache.move_to_end((params, key))
+                entries.append(self.cache[(params, key)])
+        # the cache is bounded even when the request got superseded
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        if cancelled:
+            return None
+        return assemble_streamlines(entries)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.request is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                request_id, request = self.request
+                self.request = None
+            streamlines = self.trace(request_id, request)
+            if streamlines is not None and not self.cancelled(request_id):
+                self.callback(streamlines, request_id)
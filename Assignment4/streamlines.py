@@ -1,17 +1,20 @@
 import vtk
 import argparse
+from resample_vfem import open_vfem
+from parallel_tracer import ParallelStreamTracer
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", type=str, help="path to vfem.vtu file")
     parser.add_argument("-g", type=str, help="path to wing.vtp file")
+    parser.add_argument("--resample", type=int, nargs=3, metavar=("NX", "NY", "NZ"),
+                        help="run on a cached resampling of vfem.vtu on a regular grid (see resample_vfem.py)")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of streamline tracing processes")
     return parser.parse_args()
 
-def read_vfem_velocity(vfem_filename):
-    reader = vtk.vtkXMLUnstructuredGridReader()
-    reader.SetFileName(vfem_filename)
-    reader.Update()
+def read_vfem_velocity(vfem_filename, resample=None):
+    reader = open_vfem(vfem_filename, resample)
     velocity_range = reader.GetOutput().GetPointData().GetArray("velocity").GetRange()
     print(velocity_range)
     return reader, velocity_range
@@ -71,13 +74,13 @@ def build_wing_actor(filename):
 def main():
     args = parse_args()
     vfem_filename = args.i
-    reader, velocity_range = read_vfem_velocity(vfem_filename)
+    reader, velocity_range = read_vfem_velocity(vfem_filename, args.resample)
     source = build_source_around_vortices(400)
 
-    streamline = vtk.vtkStreamTracer()
-    streamline.SetSourceConnection(source.GetOutputPort())
-    streamline.SetInputConnection(reader.GetOutputPort())
-    streamline.SetMaximumPropagation(1.5) 
+    with ParallelStreamTracer(vfem_filename, args.resample, args.workers, dataset=reader.GetOutput(),
+                              MaximumPropagation=1.5) as tracer:
+        streamline = vtk.vtkTrivialProducer()
+        streamline.SetOutput(tracer.trace(source))
 
     stream_actor, scalar_bar = build_velocity_actor(streamline.GetOutputPort(), velocity_range)
 
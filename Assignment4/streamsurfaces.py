@@ -1,47 +1,32 @@
 import vtk
 import argparse
+from resample_vfem import open_vfem
+from parallel_surfaces import stream_surfaces
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", type=str, help="path to vfem.vtu file")
     parser.add_argument("-g", type=str, help="path to wing.vtp file")
+    parser.add_argument("--resample", type=int, nargs=3, metavar=("NX", "NY", "NZ"),
+                        help="run on a cached resampling of vfem.vtu on a regular grid (see resample_vfem.py)")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="number of processes building the rake surfaces")
+    parser.add_argument("--rake-seeds", type=int, default=401, help="number of seeds per rake (maximum number if adaptive)")
+    parser.add_argument("--adaptive", action="store_true", help="insert rake seeds only where neighboring streamlines diverge")
+    parser.add_argument("--initial-seeds", type=int, default=25, help="number of seeds per rake before adaptive refinement")
+    parser.add_argument("--divergence", type=float, default=2.0,
+                        help="refine between seeds whose streamlines get this many times farther apart than on the rake")
     return parser.parse_args()
 
-def read_vfem_velocity(vfem_filename):
-    reader = vtk.vtkXMLUnstructuredGridReader()
-    reader.SetFileName(vfem_filename)
-    reader.Update()
+def read_vfem_velocity(vfem_filename, resample=None):
+    reader = open_vfem(vfem_filename, resample)
     velocity_range = reader.GetOutput().GetPointData().GetArray("velocity").GetRange()
     print(velocity_range)
     return reader, velocity_range
 
 
-def build_source_around_vortices(n_seeds):
-    seeds =vtk.vtkLineSource()
-    seeds.SetResolution(n_seeds)
-
-    trans_0 = vtk.vtkTransform()
-    trans_0.Translate(0.05, 0.01, 0.01)
-    trans_0.Scale(0.1, 1, 1)
-
-    tpd_0 = vtk.vtkTransformPolyDataFilter()
-    tpd_0.SetInputConnection(seeds.GetOutputPort())
-    tpd_0.SetTransform(trans_0)
-
-    trans_1 = vtk.vtkTransform()
-    trans_1.Translate(0.05, -0.01, 0.01)
-    trans_1.Scale(0.1, 1, 1)
-
-    tpd_1 = vtk.vtkTransformPolyDataFilter()
-    tpd_1.SetInputConnection(seeds.GetOutputPort())
-    tpd_1.SetTransform(trans_1)
-
-    append_filter = vtk.vtkAppendPolyData()
-    append_filter.AddInputConnection(tpd_0.GetOutputPort())
-    append_filter.AddInputConnection(tpd_1.GetOutputPort())
-
-    return append_filter
+# Seed rakes (end points) across the two vortices, 0.1 long along x
+VORTEX_RAKES = [ ((0.0, 0.01, 0.01), (0.1, 0.01, 0.01)), ((0.0, -0.01, 0.01), (0.1, -0.01, 0.01)) ]
 
 def build_velocity_actor(output_port, velocity_range):
     mapper = vtk.vtkDataSetMapper()
@@ -72,7 +57,7 @@ def main():
     args = parse_args()
     vfem_filename = args.i
 
-    reader, velocity_range = read_vfem_velocity(vfem_filename)
+    reader, velocity_range = read_vfem_velocity(vfem_filename, args.resample)
 
     # seeds = vtk.vtkLineSource()
     # seeds.SetResolution(100)
@@ -85,12 +70,14 @@ def main():
     # tpd_filter = vtk.vtkTransformPolyDataFilter()
     # tpd_filter.SetInputConnection(seeds.GetOutputPort())
     # tpd_filter.SetTransform(trans)
-    source = build_source_around_vortices(400)
-
-    stream_surface = vtk.vtkStreamSurface()
-    stream_surface.SetSourceConnection(source.GetOutputPort())
-    stream_surface.SetInputConnection(reader.GetOutputPort())
-    stream_surface.SetMaximumPropagation(1.5)
+    refinement = None
+    if args.adaptive:
+        refinement = { 'initial_seeds': args.initial_seeds, 'divergence': args.divergence }
+    surfaces, rake_seeds = stream_surfaces(vfem_filename, VORTEX_RAKES, args.resample, args.workers, args.rake_seeds,
+                                           refinement, dataset=reader.GetOutput(), MaximumPropagation=1.5)
+    print(f'rake seeds: {rake_seeds}')
+    stream_surface = vtk.vtkTrivialProducer()
+    stream_surface.SetOutput(surfaces)
 
     stream_actor, scalar_bar = build_velocity_actor(stream_surface.GetOutputPort(), velocity_range)
 
@@ -0,0 +1,255 @@
+import sys
+import os
+import re
+import vtk
+from vtk_misc_helper import connect
+
+'''
+Helper functions to import and export various VTK data formats
+'''
+
+def __read(reader_type, filename):
+    reader = reader_type()
+    reader.SetFileName(filename)
+    return reader
+
+def __write(writer_type, input, filename):
+    writer = writer_type()
+    writer.SetFileName(filename)
+    connect(input, writer)
+    writer.Write()
+
+def replace_extension(filename, newext):
+    return os.path.splitext(filename)[0] + newext
+
+def readVTK(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.vtk':
+        return __read(vtk.vtkDataSetReader, filename)
+    elif ext == '.vti':
+        return __read(vtk.vtkXMLImageDataReader, filename)
+    elif ext == '.vtu':
+        return __read(vtk.vtkXMLUnstructuredGridReader, filename)
+    elif ext == '.vtp':
+        return __read(vtk.vtkXMLPolyDataReader, filename)
+    elif ext == '.vtr':
+        return __read(vtk.vtkXMLRectilinearGridReader, filename)
+    else:
+        raise TypeError(f'Unrecognized VTK file extension {ext}')
+
+def saveVTK(dataset, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.vtk':
+        return __write(vtk.vtkDataSetWriter, dataset, filename)
+    elif ext == '.vti':
+        return __write(vtk.vtkXMLImageDataWriter, dataset, filename)
+    elif ext == '.vtu':
+        return __write(vtk.vtkXMLUnstructuredGridWriter, dataset, filename)
+    elif ext == '.vtp':
+        return __write(vtk.vtkXMLPolyDataWriter, dataset, filename)
+    elif ext == '.vts':
+        return __write(vtk.vtkXMLStructuredGridWriter, dataset, filename)
+    elif ext == '.vtr':
+        return __write(vtk.vtkXMLRectilinearGridWriter, dataset, filename)
+    else:
+        raise ValueError(f'Unrecognized VTK file extension: {ext}')
+
+def saveVTK_XML(dataset, filename):
+    if isinstance(dataset, vtk.vtkImageData):
+        filename = replace_extension(filename, '.vti')
+    elif isinstance(dataset, vtk.vtkUnstructuredGrid):
+        filename = replace_extension(filename, '.vtu')
+    elif isinstance(dataset, vtk.vtkPolyData):
+        filename = replace_extension(filename, '.vtp')
+    elif isinstance(dataset, vtk.vtkRectilinearGrid):
+        filename = replace_extension(filename, '.vtr')
+    elif isinstance(dataset, vtk.vtkStructuredGrid):
+        filename = replace_extension(filename, '.vts')
+    else:
+        filename = replace_extension(filename, '.vtk')
+        print('WARNING: Unrecognized VTK dataset type. Using Legacy format')
+
+    print(f'filename is {filename}')
+    saveVTK(dataset, filename)
+
+XML_TYPE_SIZES = { 'Int8': 1, 'UInt8': 1, 'Int16': 2, 'UInt16': 2, 'Int32': 4, 'UInt32': 4,
+                   'Int64': 8, 'UInt64': 8, 'Float32': 4, 'Float64': 8 }
+
+XML_COUNT_ATTRIBUTES = [ 'NumberOfPoints', 'NumberOfCells', 'NumberOfVerts', 'NumberOfLines',
+                         'NumberOfStrips', 'NumberOfPolys' ]
+
+# Data sections of a piece, and the count of their tuples
+XML_SECTIONS = { 'PointData': 'NumberOfPoints', 'CellData': 'NumberOfCells', 'Points': 'NumberOfPoints',
+                 'FieldData': None, 'Cells': None, 'Verts': None, 'Lines': None, 'Strips': None, 'Polys': None,
+                 'Coordinates': None }
+
+'''
+Tags of an XML file: (name, attributes, closing, self-closing, file offset
+past the tag, size of the text before the tag). The text is never decoded
+'''
+def __xml_tags(f, chunk_size=1 << 16):
+    buffer = b''
+    position = 0
+    text_size = 0
+    while True:
+        start = buffer.find(b'<')
+        end = buffer.find(b'>', start) if start >= 0 else -1
+        if end < 0:
+            if start < 0:
+                text_size += len(buffer)
+                position += len(buffer)
+                buffer = b''
+            else:
+                text_size += start
+                position += start
+                buffer = buffer[start:]
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buffer += chunk
+            continue
+        text_size += start
+        tag = buffer[start+1:end].decode('utf-8', 'replace')
+        position += end + 1
+        buffer = buffer[end+1:]
+        if tag.startswith('?') or tag.startswith('!'):
+            continue
+        closing = tag.startswith('/')
+        name = re.match(r'/?\s*([\w:.-]+)', tag).group(1)
+        attributes = dict(re.findall(r'([\w:.-]+)\s*=\s*"([^"]*)"', tag))
+        yield name, attributes, closing, tag.endswith('/'), position, text_size
+        text_size = 0
+
+'''
+Metadata of a VTK XML file (.vti, .vtu, .vtp, ...) read from its XML header
+only: appended array data (the default of the VTK writers) is never read and
+inline array data is skipped without being decoded. Returns a dict with the
+dataset type, dimensions (numbers of points, cells, ... or the extent, origin
+and spacing of images) and arrays: type, number of components and tuples,
+range as stored by the writer (of the magnitude for several components),
+size in memory and in the file
+'''
+def readVTK_XML_metadata(filename):
+    file_size = os.path.getsize(filename)
+    metadata = { 'file': filename, 'file_size': file_size, 'pieces': 0, 'arrays': [] }
+    counts = {}
+    arrays = {}
+    stack = []
+    piece = {}
+    appended_start = None
+    with open(filename, 'rb') as f:
+        for name, attributes, closing, self_closing, position, text_size in __xml_tags(f):
+            # inline array data
+            if stack and stack[-1][0] == 'DataArray' and stack[-1][1].get('format') != 'appended':
+                stack[-1][2]['file_size'] += text_size
+            if closing:
+                if stack:
+                    stack.pop()
+                continue
+            if name == 'VTKFile':
+                metadata['type'] = attributes.get('type')
+                metadata['version'] = attributes.get('version')
+                metadata['byte_order'] = attributes.get('byte_order')
+                metadata['header_type'] = attributes.get('header_type', 'UInt32')
+                metadata['compressor'] = attributes.get('compressor')
+            elif name == metadata.get('type') and not stack[1:]:
+                for key in [ 'WholeExtent', 'Origin', 'Spacing', 'Direction' ]:
+                    if key in attributes:
+                        metadata[key] = [ float(v) for v in attributes[key].split() ]
+                if 'WholeExtent' in metadata:
+                    extent = [ int(v) for v in metadata['WholeExtent'] ]
+                    metadata['WholeExtent'] = extent
+                    metadata['dimensions'] = [ extent[2*i+1] - extent[2*i] + 1 for i in range(3) ]
+            elif name == 'Piece':
+                metadata['pieces'] += 1
+                piece = { key: int(attributes[key]) for key in XML_COUNT_ATTRIBUTES if key in attributes }
+                if 'Extent' in attributes:
+                    extent = [ int(v) for v in attributes['Extent'].split() ]
+                    piece['NumberOfPoints'] = (extent[1]-extent[0]+1)*(extent[3]-extent[2]+1)*(extent[5]-extent[4]+1)
+                    piece['NumberOfCells'] = max(extent[1]-extent[0], 1)*max(extent[3]-extent[2], 1)*max(extent[5]-extent[4], 1)
+                for key, value in piece.items():
+                    counts[key] = counts.get(key, 0) + value
+            elif name == 'DataArray':
+                section = next((s for s, *_ in reversed(stack) if s in XML_SECTIONS), None)
+                key = (section, attributes.get('Name'))
+                components = int(attributes.get('NumberOfComponents', 1))
+                count = XML_SECTIONS.get(section)
+                tuples = int(attributes['NumberOfTuples']) if 'NumberOfTuples' in attributes else piece.get(count) if count else None
+                array = arrays.get(key)
+                if array is None:
+                    array = { 'section': section, 'name': attributes.get('Name'), 'type': attributes.get('type'),
+                              'components': components, 'tuples': None, 'range': None,
+                              'format': attributes.get('format'), 'memory_size': None, 'file_size': 0, 'offsets': [] }
+                    arrays[key] = array
+                    metadata['arrays'].append(array)
+                if tuples is not None:
+                    array['tuples'] = (array['tuples'] or 0) + tuples
+                if attributes.get('RangeMin') and attributes.get('RangeMax'):
+                    low, high = float(attributes['RangeMin']), float(attributes['RangeMax'])
+                    array['range'] = (low, high) if array['range'] is None else \
+                        (min(array['range'][0], low), max(array['range'][1], high))
+                if attributes.get('format') == 'appended':
+                    array['offsets'].append(int(attributes['offset']))
+                if not self_closing:
+                    stack.append((name, attributes, array))
+            elif name == 'AppendedData':
+                # the raw or base64 data starts after an underscore
+                f.seek(position)
+                head = f.read(1 << 12)
+                appended_start = position + head.index(b'_') + 1
+                break
+            elif not self_closing:
+                stack.append((name, attributes, None))
+
+        # appended arrays follow each other: their sizes are the differences of their offsets
+        if appended_start is not None:
+            f.seek(max(file_size - (1 << 12), appended_start))
+            tail = f.read()
+            end = tail.rfind(b'</AppendedData>')
+            appended_end = file_size - len(tail) + end if end >= 0 else file_size
+            offsets = sorted(set(o for array in metadata['arrays'] for o in array['offsets']))
+            sizes = dict(zip(offsets, [ b - a for a, b in zip(offsets, offsets[1:] + [ appended_end - appended_start ]) ]))
+            for array in metadata['arrays']:
+                array['file_size'] += sum(sizes[o] for o in array['offsets'])
+
+    for array in metadata['arrays']:
+        del array['offsets']
+        if array['tuples'] is not None and array['type'] in XML_TYPE_SIZES:
+            array['memory_size'] = array['tuples']*array['components']*XML_TYPE_SIZES[array['type']]
+    metadata.update(counts)
+    return metadata
+
+def __format_size(size):
+    if size is None:
+        return '?'
+    for unit in [ 'B', 'KB', 'MB', 'GB' ]:
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+def printVTK_XML_metadata(metadata):
+    print(f"{metadata['file']}: {metadata.get('type')} ({__format_size(metadata['file_size'])}, "
+          f"{metadata['pieces']} piece(s), compressor: {metadata.get('compressor')})")
+    if 'dimensions' in metadata:
+        print(f"Dimensions: {metadata['dimensions']}, origin: {metadata.get('Origin')}, spacing: {metadata.get('Spacing')}")
+        extent = metadata['WholeExtent']
+        origin = metadata.get('Origin', [ 0, 0, 0 ])
+        spacing = metadata.get('Spacing', [ 1, 1, 1 ])
+        print("Bounds of the dataset:", tuple(origin[i//2] + spacing[i//2]*extent[i] for i in range(6)))
+    for key in XML_COUNT_ATTRIBUTES:
+        if key in metadata:
+            print(f"{key}: {metadata[key]}")
+    for section in [ 'PointData', 'CellData', 'FieldData', 'Points', 'Coordinates', 'Cells', 'Verts', 'Lines', 'Strips', 'Polys' ]:
+        arrays = [ a for a in metadata['arrays'] if a['section'] == section ]
+        if not arrays:
+            continue
+        print(f"\n{section} arrays:")
+        for i, a in enumerate(arrays):
+            value_range = '' if a['range'] is None else f", {'|range|' if a['components'] > 1 else 'range'} {a['range']}"
+            tuples = '?' if a['tuples'] is None else a['tuples']
+            print(f"  {i}. {a['name']} - {a['type']}, {a['components']} components, {tuples} tuples{value_range}, "
+                  f"{__format_size(a['memory_size'])} in memory, {__format_size(a['file_size'])} on disk")
+
+if __name__ == '__main__':
+    for filename in sys.argv[1:]:
+        printVTK_XML_metadata(readVTK_XML_metadata(filename))
@@ -9,6 +9,7 @@ import math
 from vtk.util import numpy_support as nps
 from tqdm import tqdm
 import vtk_io_helper
+from tensor_helper import fa, tensor_fa
 import time
 import scipy as sp
 import nrrd
@@ -17,8 +18,13 @@ from matplotlib import pyplot as plt
 
 np.seterr(all='ignore')
 
-def fa(evals):
-    return np.sqrt(np.square(evals[:,0]-evals[:,1]) + np.square(evals[:,1]-evals[:,2]) + np.square(evals[:,2]-evals[:,0]))/ np.sqrt(2*(np.square(evals[:,0]) + np.square(evals[:,1]) + np.square(evals[:,2])))
+# vtkCellArray from the concatenated point ids of cells of given sizes
+def cell_array(connectivity, sizes):
+    offsets = np.zeros(len(sizes)+1, dtype=connectivity.dtype)
+    np.cumsum(sizes, out=offsets[1:])
+    cells = vtk.vtkCellArray()
+    cells.SetData(nps.numpy_to_vtk(offsets), nps.numpy_to_vtk(connectivity))
+    return cells
 
 def timer(func):
     t = time.time()
@@ -31,8 +37,12 @@ class MeshSphere:
         if nlon is None:
             nlon = 2*(nlat-2)
         self.nlon = nlon
+        self.npoints = nlat*nlon + 2
         self.angles = []
         self.triangles = []
+        self.strips = []
+        self.logs = None
+        self.power_table = None
 
     # latitudes x longitudes to point index:    
     def c2id(self, lat, lon):
@@ -86,10 +96,47 @@ class MeshSphere:
             ii = (i+1)%self.nlon
             self.triangles.append([self.ids[self.nlat-1,i], self.ids[self.nlat-1,ii], self.north_pole_id])
 
+    # Latitude bands as triangle strips, shape = (nlat-1, 2*nlon+2), and the
+    # triangles of the two caps around the poles, shape = (2*nlon, 3). 
+    # Starting each strip on the upper latitude gives the same triangles
+    # (diagonals and winding) as the bands of compute_mesh
+    def compute_strips(self):
+        if len(self.strips) == self.nlat-1:
+            return
+        self.compute_mesh()
+        lons = np.arange(self.nlon+1) % self.nlon
+        self.strips = np.stack((self.ids[1:, lons], self.ids[:-1, lons]), axis=-1).reshape((self.nlat-1, -1))
+        self.caps = np.array(self.triangles[-2*self.nlon:])
+
     def get_angles(self):
         self.compute_angles()
         return np.array(self.angles[:])
 
+    # log|cos theta|, log|sin theta|, log|cos phi|, log|sin phi|, the 
+    # absolute values themselves and their signs (with 0 counted as 
+    # positive) for all vertices. The logs of 0 are set to the lowest finite
+    # float so that 0^0 = 1 and 0^e = 0 for e > 0, as with np.power
+    def compute_logs(self):
+        if self.logs is not None:
+            return
+        self.compute_angles()
+        trig = np.stack((np.cos(self.angles[:, 0]), np.sin(self.angles[:, 0]),
+                         np.cos(self.angles[:, 1]), np.sin(self.angles[:, 1])))
+        self.signs = np.where(trig < 0, -1.0, 1.0)
+        self.abs_trig = np.abs(trig)
+        with np.errstate(divide='ignore'):
+            self.logs = np.log(self.abs_trig)
+        self.logs[np.isneginf(self.logs)] = -np.finfo(float).max
+
+    # |f(angles)|^e for n exponents e evenly spaced in [0, 1] and 
+    # the 4 functions f of compute_logs, shape = (n, 4, npoints)
+    def compute_power_table(self, n):
+        if self.power_table is not None and self.power_table.shape[0] == n:
+            return
+        self.compute_logs()
+        exponents = np.linspace(0, 1, n)
+        self.power_table = np.exp(exponents[:, np.newaxis, np.newaxis] * self.logs[np.newaxis, :, :])
+
     def get_amesh(self, index):
         self.compute_mesh()
         triangles = np.array(self.triangles[:]) # shape = (ntris, 3)
@@ -142,30 +189,84 @@ class SQTGlypher:
             self.Update()
         return 1
         
-    def __init__(self, resolution=8, gamma=0.5, scale=1, ratio=1, maxfa=1.0, use_vtk=True, verbose=False, translate=True, transform=True, clamp_mode=0) :
+    def __init__(self, resolution=8, gamma=0.5, scale=1, ratio=1, minfa=0.0, maxfa=1.0, mintrace=None, mask_name=None, use_vtk=True, verbose=False, translate=True, transform=True, clamp_mode=0, sampling_mode=0, seed=None, normals=True, power_table_size=0) :
         self.res = resolution
         self.gamma = gamma
         self.use_vtk = use_vtk
         self.scale = scale 
         self.ratio = ratio
+        self.minfa = minfa
         self.maxfa = maxfa
+        self.mintrace = mintrace
+        self.mask_name = mask_name
         self.maxsize = 1
         self.verbose = verbose
         self.translate=translate 
         self.transform=transform
         self.clamp_mode = 0
+        self.sampling_mode = sampling_mode
+        self.seed = seed
+        self.normals = normals
+        self.power_table_size = power_table_size
+        self.precision = vtk.vtkAlgorithm.DEFAULT_PRECISION
+        self.triangle_strips = False
+        self.meshes = {}
+        # view-dependent level of detail, disabled without renderer
+        self.lod_renderer = None
+        self.lod_resolutions = [4, 8, 12, 20]
+        self.lod_thresholds = [4, 16, 64]
+        self.lod = None
+        # stage name -> key of the parameters its current results were computed with
+        self.cache = {}
+        # stage name -> time spent in the stage during the last update
+        self.timings = {}
 
     '''
-    Compute tensor attributes
+    Select the subset of tensors to display according to the display ratio.
+    This is done before any eigendecomposition so that only the selected 
+    tensors are processed. Sampling modes:
+    0: uniform random sampling
+    1: stratified sampling (one random tensor per block of consecutive ids)
+    2: FA-weighted random sampling
+    '''
+    def apply_ratio(self):
+        self.all_tensors = nps.vtk_to_numpy(self.input.GetPointData().GetTensors()).reshape((-1,3,3))
+        self.all_coords = nps.vtk_to_numpy(self.input.GetPoints().GetData())
+        self.ntensors = self.all_tensors.shape[0]
+        if self.ratio is None or self.ratio == 1:
+            self.nglyphs = self.ntensors 
+            self.indices = np.arange(0, self.ntensors)
+            self.tensors = self.all_tensors
+            self.coords = self.all_coords
+            return
+
+        self.nglyphs = min(int(self.ntensors // self.ratio), self.ntensors)
+        rng = np.random.default_rng(self.seed)
+        if self.sampling_mode == 0:
+            self.indices = rng.choice(self.ntensors, self.nglyphs, replace=False)
+        elif self.sampling_mode == 1:
+            bounds = (np.arange(self.nglyphs+1)*self.ntensors) // self.nglyphs
+            self.indices = rng.integers(bounds[:-1], bounds[1:])
+        elif self.sampling_mode == 2:
+            # FA from tensor invariants avoids an eigendecomposition of all
+            # the tensors. A small floor keeps every tensor selectable
+            weights = np.maximum(np.nan_to_num(tensor_fa(self.all_tensors)), 1.0e-6)
+            self.indices = rng.choice(self.ntensors, self.nglyphs, replace=False, p=weights/np.sum(weights))
+        else:
+            raise ValueError(f'Unknown sampling mode: {self.sampling_mode}')
+        self.indices = np.sort(self.indices)
+        self.tensors = self.all_tensors[self.indices]
+        self.coords = self.all_coords[self.indices]
+
+    '''
+    Compute tensor attributes of the selected tensors
     '''
     def compute_tensor_attributes(self):
-        tensors = nps.vtk_to_numpy(self.input.GetPointData().GetTensors()).reshape((-1,3,3))
-        self.evals, self.evecs = np.linalg.eigh(tensors)
+        self.evals, self.evecs = np.linalg.eigh(self.tensors)
         self.evals[self.evals<0] = 0 # force semi-positive definiteness
         self.dets = np.prod(self.evals, axis=-1)
         self.trace = np.sum(self.evals, axis=-1)
         invtrace = np.where(self.trace==0, 0, 1/self.trace)
-        self.ntensors = tensors.shape[0]
         self.cl = (self.evals[:,2]-self.evals[:,1])*invtrace
         self.cp = 2*(self.evals[:,1]-self.evals[:,0])*invtrace
         self.fa = fa(self.evals)
@@ -175,31 +276,38 @@ class SQTGlypher:
             v = np.nan_to_num(v, copy=False, nan=0, posinf=0, neginf=0)
 
         #control saturation and value with FA
-        self.colors = self.fa[..., np.newaxis] * (self.fa[..., np.newaxis] * self.colors + (1-self.fa[..., np.newaxis] * np.ones((self.ntensors, 3), dtype=float)))
-        # self.colors = (self.fa[..., np.newaxis] * self.colors + (1-self.fa[..., np.newaxis] * np.ones((self.ntensors, 3), dtype=float)))
+        self.colors = self.fa[..., np.newaxis] * (self.fa[..., np.newaxis] * self.colors + (1-self.fa[..., np.newaxis] * np.ones((self.nglyphs, 3), dtype=float)))
+        # self.colors = (self.fa[..., np.newaxis] * self.colors + (1-self.fa[..., np.newaxis] * np.ones((self.nglyphs, 3), dtype=float)))
         self.colors = (255*self.colors).astype(np.uint8)
-        self.coords = nps.vtk_to_numpy(self.input.GetPoints().GetData())
+        # keep the arrays as they are before culling so that culling 
+        # parameters can change without recomputing them
+        self.unculled = { name: getattr(self, name) for name in self.culled_arrays }
+
+    # per-glyph arrays affected by culling
+    culled_arrays = [ 'indices', 'coords', 'evals', 'evecs', 'dets', 'trace', 'cl', 'cp', 'fa', 'colors' ]
 
     '''
-    Apply display ratio
+    Discard glyphs that would not be visible or are not wanted before any
+    geometry is generated: FA outside [self.minfa, self.maxfa], trace not 
+    larger than self.mintrace (e.g., background zero tensors), or zero value
+    in the input point data array named self.mask_name
     '''
-    def apply_ratio(self):
-        self.indices = np.arange(0, self.ntensors)
-        if self.ratio is None or self.ratio == 1:
-            self.nglyphs = self.ntensors 
-            return
-        else:
-            self.nglyphs = self.ntensors // self.ratio
-            rng = np.random.default_rng()
-            rng.shuffle(self.indices)
-            self.indices = self.indices[:self.nglyphs]
-            self.colors = self.colors[self.indices, :]
-            self.cl = self.cl[self.indices]
-            self.cp = self.cp[self.indices]
-            self.evecs = self.evecs[self.indices, :, :]
-            self.coords = self.coords[self.indices, :]
-            self.evals = self.evals[self.indices, :]
-            self.dets = self.dets[self.indices]
+    def cull(self):
+        for name, values in self.unculled.items():
+            setattr(self, name, values)
+        keep = (self.fa >= self.minfa) & (self.fa <= self.maxfa)
+        if self.mintrace is not None:
+            keep &= self.trace > self.mintrace
+        if self.mask_name is not None:
+            mask = self.input.GetPointData().GetArray(self.mask_name)
+            if mask is None:
+                raise ValueError(f'Mask array {self.mask_name} not found in the input point data')
+            mask = nps.vtk_to_numpy(mask)
+            keep &= mask[self.indices] != 0
+        if not np.all(keep):
+            for name in self.culled_arrays:
+                setattr(self, name, getattr(self, name)[keep])
+        self.nglyphs = self.indices.shape[0]
 
     '''
     Compute superquadric coefficients
@@ -214,41 +322,180 @@ class SQTGlypher:
         self.alphas[1-cmin < 1.0e-15] = 0
         self.betas[1-cmax < 1.0e-15] = 0
 
+    # interpolation needs at least the two table entries of exponents 0 and 1
+    def use_power_table(self):
+        return self.power_table_size is not None and self.power_table_size >= 2
+
+    '''
+    Raise |f(angles)| to per-glyph exponents in [0, 1] for the function f
+    of index k in MeshSphere.compute_logs. With a power table, exponents
+    are interpolated linearly between table entries, otherwise they are
+    computed as exp(e*log|f|)
     '''
-    Compute superquadrics
+    def powers(self, mesh, k, exponents):
+        if not self.use_power_table():
+            return np.exp(exponents[:, np.newaxis] * mesh.logs[np.newaxis, k, :])
+        table = mesh.power_table[:, k, :]
+        x = np.clip(exponents, 0, 1) * (table.shape[0]-1)
+        i = np.minimum(x.astype(int), table.shape[0]-2)
+        t = (x - i)[:, np.newaxis]
+        values = (1-t) * table[i] + t * table[i+1]
+        # 0^e is discontinuous at e = 0 and cannot be interpolated
+        zeros = mesh.abs_trig[k] == 0
+        values[:, zeros] = (exponents == 0)[:, np.newaxis]
+        return values
+
+    '''
+    Sphere mesh of given resolution, created once and reused
+    '''
+    def get_mesh(self, res):
+        if res not in self.meshes:
+            mesh = MeshSphere(res)
+            mesh.compute_mesh()
+            mesh.compute_logs()
+            self.meshes[res] = mesh
+        mesh = self.meshes[res]
+        if self.use_power_table():
+            mesh.compute_power_table(self.power_table_size)
+        return mesh
+
+    '''
+    Compute the points (and normals) of the unit superquadrics of the 
+    glyphs with given ids on a sphere mesh
+    '''
+    def superquadric_points(self, mesh, ids):
+        alphas = self.alphas[ids]
+        betas = self.betas[ids]
+        signs = mesh.signs
+        cos_a = self.powers(mesh, 0, alphas)
+        sin_a = self.powers(mesh, 1, alphas)
+        cos_b = self.powers(mesh, 2, betas)
+        sin_b = self.powers(mesh, 3, betas)
+        a = signs[0] * signs[3] * cos_a * sin_b
+        b = signs[1] * signs[3] * sin_a * sin_b
+        c = signs[2] * cos_b
+
+        points = np.stack((a, b, c), axis=-1)
+        isX = self.axes[ids] == 0
+        points[isX, :, :] = np.stack((c[isX, :], -b[isX, :], a[isX, :]), axis=-1)
+
+        if not self.normals:
+            return points, None
+        # Normals of the superquadric have the same form as its points
+        # with exponents 2-alpha and 2-beta (Barr, 1981), computed as 
+        # x * x^(1-alpha) to stay within the [0, 1] range of exponents
+        abs_trig = mesh.abs_trig
+        cos_a = abs_trig[0] * self.powers(mesh, 0, 1-alphas)
+        sin_a = abs_trig[1] * self.powers(mesh, 1, 1-alphas)
+        cos_b = abs_trig[2] * self.powers(mesh, 2, 1-betas)
+        sin_b = abs_trig[3] * self.powers(mesh, 3, 1-betas)
+        na = signs[0] * signs[3] * cos_a * sin_b
+        nb = signs[1] * signs[3] * sin_a * sin_b
+        nc = signs[2] * cos_b
+        normals = np.stack((na, nb, nc), axis=-1)
+        normals[isX, :, :] = np.stack((nc[isX, :], -nb[isX, :], na[isX, :]), axis=-1)
+        return points, normals
+
+    '''
+    Compute superquadrics. Glyphs are processed in groups sharing the same
+    sphere mesh: a single group at resolution self.res, or one group per 
+    level of detail
     '''
     def compute_superquadrics(self):
-        cosines = np.cos(self.angles)
-        sines = np.sin(self.angles)
-        a = np.power(np.abs(cosines[np.newaxis, :, 0]), self.alphas[:, np.newaxis]) * np.power(np.abs(sines[np.newaxis, :, 1]), self.betas[:, np.newaxis])
-        a[:,cosines[:, 0] < 0] *= -1
-        a[:,sines[:, 1] < 0] *= -1
-        b = np.power(np.abs(sines[np.newaxis, :, 0]), self.alphas[:, np.newaxis]) * np.power(np.abs(sines[np.newaxis, :, 1]), self.betas[:, np.newaxis])
-        b[:, sines[:, 0] < 0] *= -1
-        b[:, sines[:, 1] < 0] *= -1
-        c = np.power(np.abs(cosines[np.newaxis, :, 1]), self.betas[:, np.newaxis])
-        c[:, cosines[:, 1] < 0] *= -1
-        for v in [a, b, c]:
-            v = np.nan_to_num(v, copy=False, nan=0, posinf=0, neginf=0 )
-
-        self.all_points = np.stack((a, b, c), axis=-1)
-        isX = self.axes == 0
-        self.all_points[isX, :, :] = np.stack((c[isX, :], -b[isX, :], a[isX, :]), axis=-1)
-        self.all_points *= self.scale
-
-        # create mesh topology
-        self.mesh.compute_mesh()
-        ntriangles = len(self.mesh.triangles)
-
-        all_triangles = np.zeros((self.nglyphs, ntriangles, 3), dtype=np.int64)
-        all_offsets = np.arange(self.nglyphs*ntriangles+1, dtype=np.int64)*3
-        for n in range(self.nglyphs):
-            all_triangles[n,:,:] = self.mesh.get_amesh(n)
-        self.cells = vtk.vtkCellArray()
-        self.cells.SetData(nps.numpy_to_vtk(all_offsets), nps.numpy_to_vtk(all_triangles.ravel()))
-
-    '''
-    Enforce self.maxsize upper bound on glyph volumes
+        if self.lod is None:
+            self.groups = [ (self.get_mesh(self.res), np.arange(self.nglyphs)) ]
+        else:
+            self.groups = [ (self.get_mesh(res), np.flatnonzero(self.lod == level)) for level, res in enumerate(self.lod_resolutions) ]
+            self.groups = [ (mesh, ids) for mesh, ids in self.groups if len(ids) > 0 ]
+
+        self.glyph_points = []
+        self.glyph_normals = []
+        all_colors = []
+        # 32 bit point ids unless there are too many points
+        npoints = sum([ len(ids)*mesh.npoints for mesh, ids in self.groups ])
+        id_type = np.int32 if npoints <= np.iinfo(np.int32).max else np.int64
+        polys = []
+        poly_sizes = []
+        strips = []
+        strip_sizes = []
+        offset = 0
+        for mesh, ids in self.groups:
+            points, normals = self.superquadric_points(mesh, ids)
+            self.glyph_points.append(points)
+            self.glyph_normals.append(normals)
+            all_colors.append(np.repeat(self.colors[ids], mesh.npoints, axis=0))
+            # create mesh topology
+            starts = (offset + np.arange(len(ids))*mesh.npoints).astype(id_type)[:, np.newaxis, np.newaxis]
+            if self.triangle_strips:
+                # latitude bands as strips, caps as triangles
+                mesh.compute_strips()
+                strips.append((mesh.strips.astype(id_type)[np.newaxis, :, :] + starts).ravel())
+                strip_sizes.append(np.full(len(ids)*mesh.strips.shape[0], mesh.strips.shape[1], dtype=id_type))
+                triangles = mesh.caps
+            else:
+                triangles = np.array(mesh.triangles)
+            polys.append((triangles.astype(id_type)[np.newaxis, :, :] + starts).ravel())
+            poly_sizes.append(np.full(len(ids)*triangles.shape[0], 3, dtype=id_type))
+            offset += len(ids)*mesh.npoints
+
+        self.all_colors = np.concatenate(all_colors) if all_colors else np.zeros((0, 3), dtype=np.uint8)
+        if polys:
+            self.cells = cell_array(np.concatenate(polys), np.concatenate(poly_sizes))
+        else:
+            self.cells = vtk.vtkCellArray()
+        if strips:
+            self.strip_cells = cell_array(np.concatenate(strips), np.concatenate(strip_sizes))
+        else:
+            self.strip_cells = None
+
+    '''
+    Level of detail of each glyph: index of the bucket of self.lod_thresholds
+    containing its projected size in pixels with the active camera of 
+    self.lod_renderer, or -1 if the glyph lies outside the view frustum
+    '''
+    def lod_levels(self):
+        camera = self.lod_renderer.GetActiveCamera()
+        height = max(self.lod_renderer.GetSize()[1], 1)
+        if self.transform:
+            radii = self.scale * np.max(self.glyph_evals, axis=-1)
+        else:
+            radii = np.full(self.nglyphs, self.scale, dtype=float)
+        if camera.GetParallelProjection():
+            pixels = radii / camera.GetParallelScale() * height/2
+        else:
+            position = np.array(camera.GetPosition())
+            direction = np.array(camera.GetDirectionOfProjection())
+            depths = np.maximum((self.coords - position) @ direction, 1.0e-12)
+            pixels = radii / (depths * np.tan(np.radians(camera.GetViewAngle())/2)) * height/2
+        levels = np.digitize(pixels, self.lod_thresholds).astype(np.int8)
+
+        # frustum planes point inward and are normalized
+        planes = [0.0]*24
+        camera.GetFrustumPlanes(self.lod_renderer.GetTiledAspectRatio(), planes)
+        planes = np.array(planes).reshape((6, 4))
+        distances = self.coords @ planes[:, :3].T + planes[:, 3]
+        levels[np.any(distances < -radii[:, np.newaxis], axis=-1)] = -1
+        return levels
+
+    def compute_lod(self):
+        if self.lod_renderer is None:
+            self.lod = None
+        else:
+            self.lod = self.lod_levels()
+
+    '''
+    Check whether the current view would assign different levels of detail
+    than those used to create the current glyphs
+    '''
+    def lod_changed(self):
+        if self.lod_renderer is None or self.lod is None or 'size' not in self.cache:
+            return False
+        return not np.array_equal(self.lod_levels(), self.lod)
+
+    '''
+    Enforce self.maxsize upper bound on glyph volumes. The clamped 
+    eigenvalues are stored in self.glyph_evals so that self.evals is left 
+    untouched for later clamping with different parameters
     '''
     def clamp_size(self):
         if self.clamp_mode == 0:
@@ -265,31 +512,77 @@ class SQTGlypher:
             correction = self.sizes / self.maxsize
 
         too_large = self.sizes > self.maxsize 
-        self.evals[too_large, :] /= correction[too_large, np.newaxis]
+        self.glyph_evals = self.evals.copy()
+        self.glyph_evals[too_large, :] /= correction[too_large, np.newaxis]
 
 
     '''
-    Compute linear transforms associated with tensor shape
+    Compute linear transforms associated with tensor shape. The columns of
+    the eigenvector matrices are scaled by broadcasting, in the order of the
+    glyph axes (major eigenvector along x), and include the glyph scale
     '''
     def compute_xforms(self):
-        # Convert triplets of eigenvalues into 3x3 diagonal matrices
-        to_diag = np.vectorize(np.diag, signature='(n)->(n,n)')
-        Lambda = to_diag(self.evals)
-        # Compute glyph transformation matrices
-        self.evecs = np.matmul(self.evecs, Lambda)
+        evecs = self.evecs[:, :, ::-1]
+        self.xforms = evecs * (self.scale * self.glyph_evals[:, np.newaxis, ::-1])
+        # Normals transform with the inverse transpose, evecs * diag(1/evals),
+        # up to a scale factor. Use the cofactors of the eigenvalues instead 
+        # of their inverses to support zero eigenvalues
+        l0, l1, l2 = self.glyph_evals[:, 0], self.glyph_evals[:, 1], self.glyph_evals[:, 2]
+        cofactors = np.stack((l0*l1, l0*l2, l1*l2), axis=-1)
+        self.normal_xforms = evecs * cofactors[:, np.newaxis, :]
 
     '''
-    Apply linear transformations (anisotropic scaling and rotation) to all 
-    glyphs
+    Apply linear transformations (anisotropic scaling and rotation) and 
+    translations to all glyphs in a single pass, writing directly into the
+    preallocated output arrays
     '''
     def apply_xforms(self):
-        if self.transform and self.translate:
-            self.all_points = np.matvec(self.evecs[:, np.newaxis, :, [2,1,0]], self.all_points) + self.coords[:, np.newaxis, :]
-        elif self.transform:
-            self.all_points = np.matvec(self.evecs[:, np.newaxis, :, [2,1,0]], self.all_points)
-        elif self.translate:
-            self.all_points += self.coords[:, np.newaxis, :]
-        self.output.GetPoints().SetData(nps.numpy_to_vtk(self.all_points.reshape((-1, 3))))
+        if self.precision == vtk.vtkAlgorithm.SINGLE_PRECISION:
+            dtype = np.float32
+        else:
+            dtype = np.float64
+        npoints = sum([ len(ids)*mesh.npoints for mesh, ids in self.groups ])
+        self.all_points = np.empty((npoints, 3), dtype=dtype)
+        if self.normals:
+            self.all_normals = np.empty((npoints, 3), dtype=dtype)
+
+        start = 0
+        for (mesh, ids), points, normals in zip(self.groups, self.glyph_points, self.glyph_normals):
+            end = start + len(ids)*mesh.npoints
+            out = self.all_points[start:end].reshape(points.shape)
+            if self.transform:
+                np.matmul(points, np.ascontiguousarray(np.swapaxes(self.xforms[ids], 1, 2)), out=out)
+            else:
+                np.multiply(points, self.scale, out=out)
+            if self.translate:
+                out += self.coords[ids, np.newaxis, :]
+
+            if self.normals:
+                out = self.all_normals[start:end].reshape(normals.shape)
+                if self.transform:
+                    np.matmul(normals, np.ascontiguousarray(np.swapaxes(self.normal_xforms[ids], 1, 2)), out=out)
+                else:
+                    out[...] = normals
+                # the analytic normals are not unit length either
+                norms = np.sqrt(np.einsum('...i,...i->...', out, out))
+                norms[norms == 0] = 1
+                out /= norms[..., np.newaxis]
+            start = end
+
+    '''
+    Run a pipeline stage unless its cached results were computed with the 
+    same key. Keys include the key of the upstream stage so that any change
+    propagates downstream. Returns the time spent in the stage, which is 
+    also recorded in self.timings
+    '''
+    def run_stage(self, name, key, func):
+        if self.cache.get(name) == key:
+            t = 0
+        else:
+            t = timer(func)
+            self.cache[name] = key
+        self.timings[name] = t
+        return t
 
     '''
     Compute all the tensor attributes and superquadrics parameters needed
@@ -297,41 +590,60 @@ class SQTGlypher:
     '''
     def Update(self):
         if self.verbose: init = time.time()
-        self.mesh = MeshSphere(self.res)
-        self.angles = self.mesh.get_angles()
-        self.npoints = self.angles.shape[0]
 
-        tensor_t = timer(self.compute_tensor_attributes)
-        ratio_t = timer(self.apply_ratio)
-        shape_t = timer(self.compute_shapes)
-        size_t = timer(self.clamp_size)
-        xforms_t = timer(self.compute_xforms)
+        # Each stage only runs again if its own parameters or those of the
+        # stages it depends on have changed since the last update
+        ratio_key = (self.input.GetMTime(), self.ratio, self.sampling_mode, self.seed)
+        tensor_key = (ratio_key,)
+        cull_key = (tensor_key, self.minfa, self.maxfa, self.mintrace, self.mask_name)
+        shape_key = (cull_key, self.gamma)
+        size_key = (shape_key, self.clamp_mode, self.maxsize, self.scale)
+        xforms_key = (size_key,)
+        lod_key = (size_key, self.transform, tuple(self.lod_thresholds), self.lod_renderer)
+        if self.lod_renderer is not None:
+            camera = self.lod_renderer.GetActiveCamera()
+            lod_key += (camera, camera.GetMTime(), tuple(self.lod_renderer.GetSize()), self.lod_renderer.GetTiledAspectRatio())
+
+        ratio_t = self.run_stage('ratio', ratio_key, self.apply_ratio)
+        tensor_t = self.run_stage('tensor', tensor_key, self.compute_tensor_attributes)
+        cull_t = self.run_stage('cull', cull_key, self.cull)
+        shape_t = self.run_stage('shape', shape_key, self.compute_shapes)
+        size_t = self.run_stage('size', size_key, self.clamp_size)
+        xforms_t = self.run_stage('xforms', xforms_key, self.compute_xforms)
+        lod_t = self.run_stage('lod', lod_key, self.compute_lod)
+
+        # geometry only depends on the levels of detail, not on the view
+        if self.lod is None:
+            super_key = (shape_key, self.res, self.normals, self.power_table_size, self.triangle_strips)
+        else:
+            super_key = (shape_key, tuple(self.lod_resolutions), self.lod.tobytes(), self.normals, self.power_table_size, self.triangle_strips)
+        apply_x_key = (xforms_key, super_key, self.transform, self.translate, self.precision)
+        super_t = self.run_stage('superquadrics', super_key, self.compute_superquadrics)
+        apply_x_t = self.run_stage('apply_xforms', apply_x_key, self.apply_xforms)
 
-        t = time.time()
         pts = vtk.vtkPoints()
+        pts.SetData(nps.numpy_to_vtk(self.all_points))
         self.output.SetPoints(pts)
-        self.compute_superquadrics()
         self.output.SetPolys(self.cells)
-        if self.verbose: 
-            super_t = time.time()-t
-
-        # do all transforms at once
-        if self.transform or self.translate:
-            apply_x_t = timer(self.apply_xforms)
+        if self.strip_cells is not None:
+            self.output.SetStrips(self.strip_cells)
+        self.output.GetPointData().SetScalars(nps.numpy_to_vtk(self.all_colors))
+        if self.normals:
+            self.output.GetPointData().SetNormals(nps.numpy_to_vtk(self.all_normals))
         else:
-            apply_x_t = 0
-            
-        self.output.GetPointData().SetScalars(nps.numpy_to_vtk(np.tile(self.colors, (1,self.npoints)).reshape((-1, 3))))
+            self.output.GetPointData().SetNormals(None)
 
         if self.verbose:
             total_t = time.time() - init
             print(f'stats:')
             print(f' * total time: {total_t}')
-            print(f' * tensor attributes: {tensor_t} ({tensor_t/total_t*100:.1f}%)')
             print(f' * subset selection: {ratio_t} ({ratio_t/total_t*100:.1f}%)')
+            print(f' * tensor attributes: {tensor_t} ({tensor_t/total_t*100:.1f}%)')
+            print(f' * culling: {cull_t} ({cull_t/total_t*100:.1f}%)')
             print(f' * Shape parameters: {shape_t} ({shape_t/total_t*100:.1f}%)')
             print(f' * size claming: {size_t} ({size_t/total_t*100:.1f}%)')
             print(f' * linear xforms: {xforms_t} ({xforms_t/total_t*100:.1f}%)')
+            print(f' * level of detail: {lod_t} ({lod_t/total_t*100:.1f}%)')
             print(f' * superquadrics: {super_t} ({super_t/total_t*100:.1f}%)')
             print(f' * transform time: {apply_x_t} ({apply_x_t/total_t*100:.1f}%)')
 
@@ -359,12 +671,38 @@ class SuperquadricTensorGlyph(vtk.vtkPythonAlgorithm):
     def GetResolution(self):
         return self.sqa.res
 
+    # One glyph every ratio tensors (at least 1), None to display them all
     def SetDisplayRatio(self, ratio):
+        if ratio is not None and ratio < 1:
+            raise ValueError(f'Display ratio must be at least 1: {ratio}')
         self.sqa.ratio = ratio 
         self.Modified()
 
     def GetDisplayRatio(self):
         return self.sqa.ratio
+
+    def SetSamplingMode(self, mode):
+        self.sqa.sampling_mode = mode
+        self.Modified()
+
+    def GetSamplingMode(self):
+        return self.sqa.sampling_mode
+
+    def SetSamplingModeToRandom(self):
+        self.SetSamplingMode(0)
+
+    def SetSamplingModeToStratified(self):
+        self.SetSamplingMode(1)
+
+    def SetSamplingModeToFA(self):
+        self.SetSamplingMode(2)
+
+    def SetRandomSeed(self, seed):
+        self.sqa.seed = seed
+        self.Modified()
+
+    def GetRandomSeed(self):
+        return self.sqa.seed
     
     def SetScale(self, scale):
         self.sqa.scale = scale 
@@ -382,18 +720,22 @@ class SuperquadricTensorGlyph(vtk.vtkPythonAlgorithm):
 
     def SetClampingMode(self, mode):
         self.sqa.clamp_mode = mode 
+        self.Modified()
 
     def GetClampingMode(self):
         return self.sqa.clamp_mode
 
     def SetClampingModeToVolume(self):
         self.sqa.clamp_mode = 0
+        self.Modified()
 
     def SetClampingModeToLength(self):
         self.sqa.clamp_mode = 1 
+        self.Modified()
 
     def SetClampModeToDiameter(self):
         self.sqa.clamp_mode = 2
+        self.Modified()
     
     def GetMaxFA(self):
         return self.sqa.maxfa 
@@ -401,10 +743,118 @@ class SuperquadricTensorGlyph(vtk.vtkPythonAlgorithm):
     def SetMaxFA(self, mfa):
         self.sqa.maxfa = mfa
         self.Modified()
+
+    def GetMinFA(self):
+        return self.sqa.minfa
+
+    def SetMinFA(self, mfa):
+        self.sqa.minfa = mfa
+        self.Modified()
+
+    def GetMinTrace(self):
+        return self.sqa.mintrace
+
+    # None disables trace culling
+    def SetMinTrace(self, mtrace):
+        self.sqa.mintrace = mtrace
+        self.Modified()
+
+    def GetMaskArray(self):
+        return self.sqa.mask_name
+
+    # Name of a point data array of the input, glyphs are only created where
+    # it is nonzero. None disables masking
+    def SetMaskArray(self, name):
+        self.sqa.mask_name = name
+        self.Modified()
     
+    # Number of tabulated exponents used to evaluate superquadrics by 
+    # interpolation, 0 (or 1, too few to interpolate) to evaluate them exactly
+    def SetPowerTableSize(self, size):
+        if size is not None and size < 0:
+            raise ValueError(f'Power table size must not be negative: {size}')
+        self.sqa.power_table_size = size
+        self.Modified()
+
+    def GetPowerTableSize(self):
+        return self.sqa.power_table_size
+
+    # vtkAlgorithm.SINGLE_PRECISION for float32 points and normals, 
+    # DOUBLE_PRECISION or DEFAULT_PRECISION for float64
+    def SetOutputPointsPrecision(self, precision):
+        self.sqa.precision = precision
+        self.Modified()
+
+    def GetOutputPointsPrecision(self):
+        return self.sqa.precision
+
+    # Output latitude bands of the glyphs as triangle strips (and the caps 
+    # around the poles as triangles) instead of independent triangles
+    def SetGenerateTriangleStrips(self, do_strips):
+        self.sqa.triangle_strips = do_strips
+        self.Modified()
+
+    def GetGenerateTriangleStrips(self):
+        return self.sqa.triangle_strips
+
+    def GenerateTriangleStripsOn(self):
+        self.SetGenerateTriangleStrips(True)
+
+    def GenerateTriangleStripsOff(self):
+        self.SetGenerateTriangleStrips(False)
+
+    def SetComputeNormals(self, do_compute):
+        self.sqa.normals = do_compute
+        self.Modified()
+
+    def GetComputeNormals(self):
+        return self.sqa.normals
+
+    def ComputeNormalsOn(self):
+        self.SetComputeNormals(True)
+
+    def ComputeNormalsOff(self):
+        self.SetComputeNormals(False)
+
+    # Choose the resolution of each glyph from its projected size with the
+    # active camera of renderer, and skip glyphs outside the view frustum.
+    # Glyphs are only regenerated when a render would change their levels
+    # of detail. None disables level of detail
+    def SetLODRenderer(self, renderer):
+        if self.sqa.lod_renderer is not None:
+            self.sqa.lod_renderer.RemoveObserver(self.lod_observer)
+        self.sqa.lod_renderer = renderer
+        if renderer is not None:
+            self.lod_observer = renderer.AddObserver('StartEvent', self.CheckLOD)
+        self.Modified()
+
+    def GetLODRenderer(self):
+        return self.sqa.lod_renderer
+
+    # resolutions: sphere resolution of each level of detail, from coarsest
+    # to finest. thresholds: projected glyph sizes (in pixels) separating 
+    # consecutive levels
+    def SetLODLevels(self, resolutions, thresholds):
+        if len(thresholds) != len(resolutions)-1:
+            raise ValueError('Need one threshold less than resolutions')
+        self.sqa.lod_resolutions = list(resolutions)
+        self.sqa.lod_thresholds = list(thresholds)
+        self.Modified()
+
+    def GetLODLevels(self):
+        return self.sqa.lod_resolutions, self.sqa.lod_thresholds
+
+    def CheckLOD(self, obj=None, event=None):
+        if self.sqa.lod_changed():
+            self.Modified()
+
     def GetOutput(self):
         return vtk.vtkPolyData.SafeDownCast(vtk.vtkPythonAlgorithm.GetOutputDataObject(self, 0))
 
+    # Time spent in each stage during the last update (0 for cached stages)
+    def GetTimings(self):
+        return dict(self.sqa.timings)
+
     def SetVerbosity(self, verbose=True):
         self.sqa.verbose = verbose
 
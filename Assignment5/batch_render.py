@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import vtk
+
+from seeding import SAMPLING_MODES
+
+'''
+Offscreen batch rendering of the DTI visualizations (tensor glyphs, fibers
+and FA volume with fibers) of many subjects to PNG images. Each subject is
+processed in a worker process that loads its volume and builds its scene
+once, then renders it from every camera preset.
+
+On machines without a display, use a VTK build with OSMesa (e.g. the
+vtk-osmesa wheel) and the --osmesa option, or rely on the EGL window that
+VTK selects when no X server is available.
+'''
+
+SCENES = [ 'glyphs', 'fibers', 'fa_lines' ]
+
+# preset name: (direction from the focal point to the camera, view up)
+CAMERA_PRESETS = {
+    'axial': ((0, 0, 1), (0, 1, 0)),
+    'coronal': ((0, -1, 0), (0, 0, 1)),
+    'sagittal': ((1, 0, 0), (0, 0, 1)),
+    'oblique': ((1, -1, 1), (0, 0, 1)),
+}
+
+def load_camera_from_json(camera, filename):
+    with open(filename, "r") as f:
+        camera_data = json.load(f)
+    camera.SetPosition(camera_data["Position"])
+    camera.SetFocalPoint(camera_data["FocalPoint"])
+    camera.SetViewUp(camera_data["ViewUp"])
+    camera.SetClippingRange(camera_data["ClippingRange"])
+    camera.SetViewAngle(camera_data["ViewAngle"])
+    camera.SetParallelScale(camera_data["ParallelScale"])
+
+def preset_name(preset):
+    return os.path.splitext(os.path.basename(preset))[0] if preset.endswith('.json') else preset
+
+'''
+Camera presets are either the name of a view of the volume (see
+CAMERA_PRESETS), which is framed to fit the scene, or a camera JSON file
+as saved by the interactive tools
+'''
+def set_camera(renderer, preset):
+    camera = renderer.GetActiveCamera()
+    if preset.endswith('.json'):
+        load_camera_from_json(camera, preset)
+        return
+    direction, view_up = CAMERA_PRESETS[preset]
+    renderer.ResetCamera()
+    focal_point = camera.GetFocalPoint()
+    distance = camera.GetDistance()
+    norm = sum(d*d for d in direction) ** 0.5
+    camera.SetPosition(*[ f + distance*d/norm for f, d in zip(focal_point, direction) ])
+    camera.SetViewUp(*view_up)
+    renderer.ResetCamera()
+
+def create_glyph_scene(volume, args):
+    from tensor_glyphs import create_plane_source, slice_volume, create_tensor_glyphs, create_glyph_actor
+    bounds = volume.GetBounds()
+    dims = volume.GetDimensions()
+    actors = []
+    for position, orientation, color in zip(volume.GetCenter(), 'XYZ', [ (1, 0, 0), (0, 1, 0), (0, 0, 1) ]):
+        plane = create_plane_source(position, orientation, bounds, dims)
+        glyphs = create_tensor_glyphs(slice_volume(volume, plane), minfa=args.minfa)
+        actors.append(create_glyph_actor(glyphs, color))
+    return actors
+
+def create_fiber_actor(volume, args, line_width=1.0):
+    from tensor_glyphs import create_plane_source
+    from seeding import combine_sampled_plane_points
+    from fibers import trace_fibers
+    bounds = volume.GetBounds()
+    dims = volume.GetDimensions()
+    planes = [ create_plane_source(position, orientation, bounds, dims).GetOutput()
+               for position, orientation in zip(volume.GetCenter(), 'XYZ') ]
+    seeds = combine_sampled_plane_points(planes, args.seeds, seed=args.seed, mode=args.sampling, volume=volume)
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputData(trace_fibers(volume, seeds))
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    actor.GetProperty().SetLineWidth(line_width)
+    return actor
+
+def create_fiber_scene(volume, args):
+    return [ create_fiber_actor(volume, args) ]
+
+def create_fa_lines_scene(volume, args):
+    from fa_lines import load_fa_volume, create_fa_volume_actor
+    fa_volume = load_fa_volume(args.input_file, volume)
+    return [ create_fa_volume_actor(fa_volume), create_fiber_actor(volume, args, line_width=2.0) ]
+
+def render_subject(args):
+    from tensor_glyphs import read_dti_volume
+    t = time.time()
+    if not os.path.exists(args.input_file):
+        raise FileNotFoundError(args.input_file)
+    volume = read_dti_volume(args.input_file)
+    scene = { 'glyphs': create_glyph_scene, 'fibers': create_fiber_scene, 'fa_lines': create_fa_lines_scene }[args.scene]
+
+    renderer = vtk.vtkRenderer()
+    renderer.SetBackground(0, 0, 0)
+    for prop in scene(volume, args):
+        renderer.AddViewProp(prop)
+    window = vtk.vtkRenderWindow()
+    window.SetOffScreenRendering(1)
+    window.SetSize(*args.resolution)
+    window.AddRenderer(renderer)
+
+    image = vtk.vtkWindowToImageFilter()
+    image.SetInput(window)
+    image.ReadFrontBufferOff()
+    image.ShouldRerenderOff()
+    png_writer = vtk.vtkPNGWriter()
+    png_writer.SetInputConnection(image.GetOutputPort())
+
+    subject = os.path.splitext(os.path.basename(args.input_file))[0]
+    files = []
+    for preset in args.cameras:
+        set_camera(renderer, preset)
+        window.Render()
+        image.Modified()
+        file_name = os.path.join(args.output, f'{subject}_{args.scene}_{preset_name(preset)}.png')
+        png_writer.SetFileName(file_name)
+        png_writer.Write()
+        files.append(file_name)
+    window.Finalize()
+    return files, time.time() - t
+
+def render_subject_safe(args):
+    try:
+        files, elapsed = render_subject(args)
+        return args.input_file, files, elapsed, None
+    except Exception as e:
+        return args.input_file, [], 0, f'{type(e).__name__}: {e}'
+
+def main():
+    parser = argparse.ArgumentParser(description="Render DTI visualizations of many subjects offscreen to PNG")
+    parser.add_argument("inputs", nargs='+', help="DTI .vti files")
+    parser.add_argument("-s", "--scene", choices=SCENES, default='glyphs', help="Visualization to render")
+    parser.add_argument("-c", "--cameras", nargs='+', default=list(CAMERA_PRESETS.keys()),
+                        help=f"Camera presets ({', '.join(CAMERA_PRESETS.keys())}) or camera JSON files")
+    parser.add_argument("-o", "--output", default='.', help="Output directory")
+    parser.add_argument("-r", "--resolution", type=int, nargs=2, default=[1024, 768], help="Image resolution")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--osmesa", action="store_true", help="Use the OSMesa software render window")
+    parser.add_argument("--minfa", type=float, default=0, help="Do not draw glyphs with lower FA")
+    parser.add_argument("-n", "--seeds", type=int, default=5000, help="Number of fiber seed points")
+    parser.add_argument("--sampling", choices=SAMPLING_MODES, default='random', help="Fiber seed sampling mode")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the fiber seed sampling")
+    args = parser.parse_args()
+
+    for preset in args.cameras:
+        if not preset.endswith('.json') and preset not in CAMERA_PRESETS:
+            parser.error(f'unknown camera preset {preset}')
+    os.makedirs(args.output, exist_ok=True)
+    if args.osmesa:
+        # read by VTK when the render window is created, inherited by the workers
+        os.environ['VTK_DEFAULT_OPENGL_WINDOW'] = 'vtkOSOpenGLRenderWindow'
+
+    tasks = [ argparse.Namespace(**vars(args), input_file=input_file) for input_file in args.inputs ]
+    workers = min(args.workers, len(tasks))
+    # Mesa's llvmpipe starts one thread per core in every process: share the
+    # cores between the workers instead of oversubscribing them
+    os.environ.setdefault('LP_NUM_THREADS', str(max(1, os.cpu_count() // workers)))
+    failures = 0
+    t = time.time()
+    # spawn gives each worker a fresh OpenGL context
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for input_file, files, elapsed, error in pool.imap_unordered(render_subject_safe, tasks):
+            if error is not None:
+                failures += 1
+                print(f'{input_file}: failed ({error})')
+            else:
+                print(f'{input_file}: {len(files)} images in {elapsed:.1f} s')
+    print(f'{len(tasks) - failures}/{len(tasks)} subjects rendered in {time.time() - t:.1f} s')
+    if failures > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
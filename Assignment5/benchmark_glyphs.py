@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+import numpy as np
+import vtk
+from vtk.util import numpy_support as nps
+from SuperquadricTensorGlyph import SuperquadricTensorGlyph, MeshSphere
+
+'''
+Reproducible benchmark of SuperquadricTensorGlyph on synthetic tensor sets.
+Each configuration runs in a fresh worker process so that peak memory
+measurements do not carry over between configurations.
+'''
+
+STAGES = [ 'ratio', 'tensor', 'cull', 'shape', 'size', 'xforms', 'lod', 'superquadrics', 'apply_xforms' ]
+
+'''
+Random symmetric positive definite tensors with DTI-like eigenvalues on a
+regular grid of points. A fraction of them are set to zero to mimic the
+background of brain slices
+'''
+def synthetic_tensors(ntensors, background=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(ntensors)))
+    ij = np.stack(np.unravel_index(np.arange(ntensors), (side, side)), axis=-1)
+    coords = np.zeros((ntensors, 3))
+    coords[:, :2] = ij
+    evals = np.sort(rng.uniform(1.0e-4, 2.0e-3, size=(ntensors, 3)), axis=-1)
+    rotations, _ = np.linalg.qr(rng.normal(size=(ntensors, 3, 3)))
+    tensors = np.matmul(rotations * evals[:, np.newaxis, :], np.swapaxes(rotations, 1, 2))
+    tensors[rng.random(ntensors) < background] = 0
+
+    points = vtk.vtkPoints()
+    points.SetData(nps.numpy_to_vtk(coords, deep=1))
+    array = nps.numpy_to_vtk(tensors.reshape((-1, 9)), deep=1)
+    array.SetName('tensors')
+    data = vtk.vtkPolyData()
+    data.SetPoints(points)
+    data.GetPointData().SetTensors(array)
+    return data
+
+def make_glyph(data, config):
+    glyph = SuperquadricTensorGlyph()
+    glyph.SetInputData(data)
+    glyph.SetResolution(config['resolution'])
+    glyph.SetClampingMode(config['clamp_mode'])
+    glyph.SetGamma(config['gamma'])
+    glyph.SetScale(1000)
+    glyph.SetMaxSize(10)
+    glyph.SetComputeNormals(config['normals'])
+    glyph.SetGenerateTriangleStrips(config['strips'])
+    return glyph
+
+def run_config(config):
+    # warm up lazy imports (e.g. scipy.special) outside of the measurements
+    make_glyph(synthetic_tensors(10), config).Update()
+
+    data = synthetic_tensors(config['ntensors'], config['background'], config['seed'])
+    best = None
+    # timed runs without tracing, whose per-allocation overhead would
+    # inflate the stage times unevenly
+    for _ in range(config['repeat']):
+        # new filter each time so that no stage is cached
+        glyph = make_glyph(data, config)
+        t = time.time()
+        glyph.Update()
+        total = time.time() - t
+        if best is None or total < best['total_time']:
+            output = glyph.GetOutput()
+            timings = glyph.GetTimings()
+            best = { 'total_time': total,
+                     'npoints': output.GetNumberOfPoints(), 'ncells': output.GetNumberOfCells() }
+            for stage in STAGES:
+                best[f'{stage}_time'] = timings.get(stage, 0)
+        del glyph
+
+    # separate untimed run for the peak memory
+    glyph = make_glyph(data, config)
+    tracemalloc.start()
+    glyph.Update()
+    best['peak_numpy_mb'] = tracemalloc.get_traced_memory()[1]/1.0e6
+    tracemalloc.stop()
+    del glyph
+    best['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1.0e3
+    return dict(config, **best)
+
+# Triangles of triangle strips, shape = (nstrips, n) -> (nstrips*(n-2), 3).
+# Every other triangle is flipped to keep the winding of the first one, as
+# when a strip is rendered
+def strip_triangles(strips):
+    triangles = np.stack((strips[:, :-2], strips[:, 1:-1], strips[:, 2:]), axis=-1)
+    triangles[:, 1::2, :2] = triangles[:, 1::2, 1::-1]
+    return triangles.reshape((-1, 3))
+
+# Whether two sets of triangles are equal up to order, with the same winding
+def same_triangles(a, b):
+    def canonical(triangles):
+        # rotate the smallest id first, which keeps the winding
+        first = np.argmin(triangles, axis=-1)[:, np.newaxis]
+        rotated = np.take_along_axis(triangles, (first + np.arange(3)) % 3, axis=-1)
+        return rotated[np.lexsort(rotated.T[::-1])]
+    return a.shape == b.shape and np.array_equal(canonical(a), canonical(b))
+
+'''
+Check that the triangle strips of the sphere meshes of the given resolutions
+have the same triangles (diagonals and winding) as their triangle meshes.
+Returns the resolutions whose strips do not match
+'''
+def check_strips(resolutions):
+    mismatches = []
+    for res in resolutions:
+        mesh = MeshSphere(res)
+        mesh.compute_strips()
+        if not same_triangles(strip_triangles(mesh.strips), np.array(mesh.triangles[:-2*mesh.nlon])):
+            mismatches.append(res)
+    return mismatches
+
+def glyph_points(ntensors, resolution):
+    return ntensors * (resolution*2*(resolution-2) + 2)
+
+def compare(results, baseline_file, tolerance):
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)['results']
+    keys = [ 'ntensors', 'resolution', 'clamp_mode', 'gamma', 'background', 'normals', 'strips' ]
+    reference = { tuple(r[k] for k in keys): r for r in baseline if not r.get('skipped') }
+    regressions = 0
+    for r in results:
+        ref = reference.get(tuple(r[k] for k in keys))
+        if r.get('skipped') or ref is None:
+            continue
+        ratio = r['total_time'] / ref['total_time']
+        flag = ''
+        if ratio > tolerance:
+            regressions += 1
+            flag = ' REGRESSION'
+        print(f'{r["ntensors"]} tensors, res {r["resolution"]}, clamp {r["clamp_mode"]}: {ratio:.2f}x baseline{flag}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SuperquadricTensorGlyph on synthetic tensors')
+    parser.add_argument('-n', '--ntensors', type=int, nargs='+', default=[1000, 10000, 100000, 1000000], help='Numbers of tensors')
+    parser.add_argument('-r', '--resolutions', type=int, nargs='+', default=[4, 8, 12], help='Glyph resolutions')
+    parser.add_argument('-c', '--clamp-modes', type=int, nargs='+', default=[0, 1, 2], help='Clamping modes (0: volume, 1: length, 2: diameter)')
+    parser.add_argument('--gamma', type=float, default=5, help='Glyph sharpness')
+    parser.add_argument('--background', type=float, default=0, help='Fraction of zero tensors')
+    parser.add_argument('--no-normals', action='store_true', help='Do not compute normals')
+    parser.add_argument('--strips', action='store_true', help='Output triangle strips')
+    parser.add_argument('--check-strips', action='store_true', help='Check that the triangle strips match the triangle meshes first')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per configuration, the fastest is reported')
+    parser.add_argument('--max-points', type=float, default=5.0e7, help='Skip configurations producing more glyph points')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic tensors')
+    parser.add_argument('--json', type=str, help='JSON output file')
+    parser.add_argument('--csv', type=str, help='CSV output file')
+    parser.add_argument('--baseline', type=str, help='JSON output of a previous run to compare to')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='Maximum slowdown relative to baseline')
+    args = parser.parse_args()
+
+    if args.check_strips:
+        mismatches = check_strips(args.resolutions)
+        if mismatches:
+            print(f'triangle strips do not match the mesh at resolutions {mismatches}')
+            sys.exit(1)
+
+    configs = []
+    for n, res, mode in itertools.product(args.ntensors, args.resolutions, args.clamp_modes):
+        configs.append({ 'ntensors': n, 'resolution': res, 'clamp_mode': mode, 'gamma': args.gamma,
+                         'background': args.background, 'normals': not args.no_normals,
+                         'strips': args.strips, 'repeat': args.repeat, 'seed': args.seed })
+
+    results = []
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        for config in configs:
+            if glyph_points(config['ntensors'], config['resolution']) > args.max_points:
+                print(f'skipping {config["ntensors"]} tensors at resolution {config["resolution"]}')
+                results.append(dict(config, skipped=True))
+                continue
+            r = pool.apply(run_config, (config,))
+            print(f'{r["ntensors"]} tensors, res {r["resolution"]}, clamp {r["clamp_mode"]}: '
+                  f'{r["total_time"]:.3f} s, peak numpy {r["peak_numpy_mb"]:.1f} MB, max RSS {r["max_rss_mb"]:.1f} MB')
+            results.append(r)
+
+    if args.json is not None:
+        info = { 'python': platform.python_version(), 'numpy': np.__version__,
+                 'vtk': vtk.vtkVersion.GetVTKVersion(), 'platform': platform.platform(),
+                 'date': time.strftime('%Y-%m-%dT%H:%M:%S') }
+        with open(args.json, 'w') as f:
+            json.dump({ 'info': info, 'results': results }, f, indent=2)
+    if args.csv is not None:
+        fields = list(configs[0].keys()) + [ 'skipped', 'total_time' ] + [ f'{s}_time' for s in STAGES ] + \
+                 [ 'peak_numpy_mb', 'max_rss_mb', 'npoints', 'ncells' ]
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for r in results:
+                writer.writerow(dict(r, skipped=r.get('skipped', False)))
+
+    if args.baseline is not None and compare(results, args.baseline, args.tolerance) > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
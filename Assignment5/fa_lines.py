@@ -1,9 +1,14 @@
 import vtk
 import argparse
+import glob
+import hashlib
+import os
 import numpy as np
-import random
+from vtk.util import numpy_support as nps
 
 from TensorLines import TensorLines
+from seeding import SAMPLING_MODES, combine_sampled_plane_points
+from tensor_helper import fa
 
 def read_volume(filename):
     reader = vtk.vtkXMLImageDataReader()
@@ -17,6 +22,59 @@ def read_dti_volume(filename):
     reader.Update()
     return reader.GetOutput()
 
+'''
+FA scalar volume of a DTI volume, from eigenvalues computed in batches of
+chunk_size tensors to bound the size of the temporaries. Negative
+eigenvalues are clamped to 0 as for the glyphs
+'''
+def compute_fa_volume(dti_volume, chunk_size=1<<18):
+    tensors = nps.vtk_to_numpy(dti_volume.GetPointData().GetTensors()).reshape((-1, 3, 3))
+    values = np.zeros(tensors.shape[0], dtype=np.float32)
+    for start in range(0, tensors.shape[0], chunk_size):
+        evals = np.linalg.eigvalsh(tensors[start:start+chunk_size])
+        evals[evals<0] = 0 # force semi-positive definiteness
+        values[start:start+chunk_size] = np.nan_to_num(fa(evals))
+    np.clip(values, 0, 1, out=values)
+
+    fa_image = vtk.vtkImageData()
+    # extent, origin, spacing and direction
+    fa_image.CopyStructure(dti_volume)
+    array = nps.numpy_to_vtk(values)
+    array.SetName('FA')
+    fa_image.GetPointData().SetScalars(array)
+    return fa_image
+
+# Hash of the tensors and geometry of a DTI volume already in memory
+def volume_hash(dti_volume):
+    h = hashlib.sha256()
+    tensors = nps.vtk_to_numpy(dti_volume.GetPointData().GetTensors())
+    h.update(memoryview(np.ascontiguousarray(tensors)))
+    h.update(np.array(dti_volume.GetExtent(), dtype=np.int64).tobytes())
+    h.update(np.array(dti_volume.GetSpacing() + dti_volume.GetOrigin(), dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+'''
+FA volume of the DTI file, cached next to it in a file named after the hash
+of the loaded tensors so that a modified DTI file is never paired with a
+stale FA. Writing a new cache removes those of earlier versions of the file
+'''
+def load_fa_volume(dti_filename, dti_volume, use_cache=True):
+    if not use_cache:
+        return compute_fa_volume(dti_volume)
+    base = os.path.splitext(dti_filename)[0]
+    cache_file = f'{base}.fa-{volume_hash(dti_volume)[:16]}.vti'
+    if os.path.exists(cache_file):
+        return read_volume(cache_file)
+    fa_image = compute_fa_volume(dti_volume)
+    for stale_file in glob.glob(f'{glob.escape(base)}.fa-*.vti'):
+        os.remove(stale_file)
+    writer = vtk.vtkXMLImageDataWriter()
+    writer.SetFileName(cache_file)
+    writer.SetInputData(fa_image)
+    if not writer.Write():
+        print(f'unable to write FA cache {cache_file}')
+    return fa_image
+
 def create_fa_volume_actor(fa_image):
     ctf = vtk.vtkColorTransferFunction()
     otf = vtk.vtkPiecewiseFunction()
@@ -77,48 +135,8 @@ def create_plane_source(slice_position, orientation, bounds, dims):
     plane.Update()
     return plane
 
-def sample_plane_points(polydata, num_samples):
-    
-    num_points = polydata.GetNumberOfPoints()
-    if num_samples >= num_points:
-        return polydata  # No need to sample if we want more or equal points
-
-    indices = random.sample(range(num_points), num_samples)
-    sampled_points = vtk.vtkPoints()
-    for index in indices:
-        x, y, z = polydata.GetPoint(index)
-        sampled_points.InsertNextPoint(x, y, z)
-
-    sampled_polydata = vtk.vtkPolyData()
-    sampled_polydata.SetPoints(sampled_points)
-    return sampled_polydata
-
-def combine_sampled_plane_points(polydatas, num_total_samples=5000):
-    active_planes = [pd for pd in polydatas if pd is not None and pd.GetNumberOfPoints() > 0]
-    num_active = len(active_planes)
-    if num_active == 0:
-        seed_poly_data = vtk.vtkPolyData()
-        seed_poly_data.SetPoints(vtk.vtkPoints())
-        return seed_poly_data
-
-    samples_per_plane = num_total_samples // num_active
-    remaining_samples = num_total_samples % num_active
-
-    all_points = vtk.vtkPoints()
-    for i, pd in enumerate(active_planes):
-        n_samples = samples_per_plane + (1 if i < remaining_samples else 0)
-        sampled_pd = sample_plane_points(pd, n_samples)
-        num_pts = sampled_pd.GetNumberOfPoints()
-        for j in range(num_pts):
-            x, y, z = sampled_pd.GetPoint(j)
-            all_points.InsertNextPoint(x, y, z)
-
-    seed_poly_data = vtk.vtkPolyData()
-    seed_poly_data.SetPoints(all_points)
-    return seed_poly_data
-
-def create_seed_points(clipping_planes, num_total_samples=5000):
-    return combine_sampled_plane_points(clipping_planes, num_total_samples)
+def create_seed_points(clipping_planes, num_total_samples=5000, **kwargs):
+    return combine_sampled_plane_points(clipping_planes, num_total_samples, **kwargs)
 
 
 def main():
@@ -126,11 +144,18 @@ def main():
         description="Visualize FA volume (in white) with volume rendering + DTI fiber tracts."
     )
     parser.add_argument("-i", "--input", required=True, help="Path to input DTI .vti file (with tensors)")
-    parser.add_argument("--fa", required=True, help="Path to FA .vti file (scalar volume)")
+    parser.add_argument("--fa", help="Path to FA .vti file (scalar volume), computed from the tensors if omitted")
+    parser.add_argument("--no-cache", action="store_true", help="Do not cache the computed FA volume on disk")
+    parser.add_argument("-n", "--seeds", type=int, default=5000, help="Number of seed points")
+    parser.add_argument("--sampling", choices=SAMPLING_MODES, default='random', help="Seed sampling mode")
+    parser.add_argument("--seed", type=int, help="Random seed of the seed sampling")
     args = parser.parse_args()
 
     dti_volume = read_dti_volume(args.input)
-    fa_volume = read_volume(args.fa)
+    if args.fa is not None:
+        fa_volume = read_volume(args.fa)
+    else:
+        fa_volume = load_fa_volume(args.input, dti_volume, use_cache=not args.no_cache)
 
     fa_volume_actor = create_fa_volume_actor(fa_volume)
    
@@ -161,7 +186,8 @@ def main():
 
 
     clipping_planes = [polyX, polyY, polyZ]  
-    seeds = create_seed_points(clipping_planes, num_total_samples=5000)
+    seeds = create_seed_points(clipping_planes, num_total_samples=args.seeds,
+                               seed=args.seed, mode=args.sampling, volume=dti_volume)
     tlines.SetSource(seeds)
     tlines.Update()
 
@@ -0,0 +1,82 @@
+import vtk
+import numpy as np
+from vtk.util import numpy_support as nps
+from tensor_helper import tensor_fa
+
+'''
+Seed point sampling on planes for fiber tracking. Indices are drawn with a
+seeded numpy generator, coordinates are gathered with a single fancy
+indexing operation and handed to VTK without copy.
+
+Sampling modes:
+    random: uniform sampling without replacement
+    stratified: one random point in each of num_samples equal index ranges,
+        which spreads the seeds over the rows of a plane
+    fa: sampling without replacement with probability proportional to the
+        fractional anisotropy of the tensor volume at each point
+'''
+SAMPLING_MODES = [ 'random', 'stratified', 'fa' ]
+
+def sample_indices(num_points, num_samples, rng, mode='random', weights=None):
+    if mode == 'random':
+        indices = rng.choice(num_points, num_samples, replace=False)
+    elif mode == 'stratified':
+        bounds = (np.arange(num_samples+1)*num_points) // num_samples
+        indices = rng.integers(bounds[:-1], bounds[1:])
+    elif mode == 'fa':
+        if weights is None:
+            raise ValueError('FA-weighted sampling requires weights')
+        # a small floor keeps every point selectable
+        weights = np.maximum(np.nan_to_num(weights), 1.0e-6)
+        indices = rng.choice(num_points, num_samples, replace=False, p=weights/np.sum(weights))
+    else:
+        raise ValueError(f'Unknown sampling mode: {mode}')
+    return np.sort(indices)
+
+# FA of the volume tensors at the points of polydata
+def point_fa(volume, polydata):
+    probe = vtk.vtkProbeFilter()
+    probe.SetInputData(polydata)
+    probe.SetSourceData(volume)
+    probe.Update()
+    tensors = nps.vtk_to_numpy(probe.GetOutput().GetPointData().GetTensors()).reshape((-1, 3, 3))
+    return tensor_fa(tensors)
+
+def points_polydata(coords):
+    points = vtk.vtkPoints()
+    points.SetData(nps.numpy_to_vtk(np.ascontiguousarray(coords)))
+    polydata = vtk.vtkPolyData()
+    polydata.SetPoints(points)
+    return polydata
+
+def sample_plane_coords(polydata, num_samples, rng, mode='random', volume=None):
+    coords = nps.vtk_to_numpy(polydata.GetPoints().GetData())
+    num_points = coords.shape[0]
+    if num_samples >= num_points:
+        return coords  # No need to sample if we want more or equal points
+    weights = point_fa(volume, polydata) if mode == 'fa' else None
+    return coords[sample_indices(num_points, num_samples, rng, mode, weights)]
+
+def sample_plane_points(polydata, num_samples, seed=None, mode='random', volume=None):
+    rng = np.random.default_rng(seed)
+    return points_polydata(sample_plane_coords(polydata, num_samples, rng, mode, volume))
+
+'''
+Sample num_total_samples seeds spread evenly over the given planes. The
+volume is only needed for FA-weighted sampling
+'''
+def combine_sampled_plane_points(polydatas, num_total_samples=5000, seed=None, mode='random', volume=None):
+    active_planes = [pd for pd in polydatas if pd is not None and pd.GetNumberOfPoints() > 0]
+    num_active = len(active_planes)
+    if num_active == 0:
+        return points_polydata(np.zeros((0, 3)))
+
+    samples_per_plane = num_total_samples // num_active
+    remaining_samples = num_total_samples % num_active
+
+    rng = np.random.default_rng(seed)
+    coords = []
+    for i, pd in enumerate(active_planes):
+        n_samples = samples_per_plane + (1 if i < remaining_samples else 0)
+        coords.append(sample_plane_coords(pd, n_samples, rng, mode, volume))
+    return points_polydata(np.concatenate(coords))
@@ -0,0 +1,109 @@
+from PyQt5.QtWidgets import QApplication, QWidget, QMainWindow, QSlider, QGridLayout, QLabel
+import PyQt5.QtCore as QtCore
+from PyQt5.QtCore import Qt
+import vtk
+from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+import sys
+import time
+
+from tensor_glyphs import SliceGlyphCache, create_glyph_actor, slice_index, slice_position
+
+'''
+Browse the X, Y and Z glyph slices of a DTI volume with sliders. Glyphs come
+from a SliceGlyphCache, and the neighbors of a slice are prefetched once the
+slider has stopped moving for a moment
+'''
+class SliceBrowserUI(QMainWindow):
+    ORIENTATIONS = [ 'X', 'Y', 'Z' ]
+    COLORS = [ (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0) ]
+
+    def __init__(self, volume, positions, args, parent=None):
+        QMainWindow.__init__(self, parent)
+        self.volume = volume
+        self.cache = SliceGlyphCache(volume, capacity=args.cache_size, prefetch=args.prefetch, minfa=args.minfa)
+        self.indices = [ slice_index(volume, o, p) for o, p in zip(self.ORIENTATIONS, positions) ]
+        self.prefetch_delay = 150
+        self.setup_ui()
+        self.setup_vtk_pipeline()
+        self.setup_sliders()
+        self.setup_connections()
+
+    def setup_ui(self):
+        self.centralWidget = QWidget()
+        self.gridlayout = QGridLayout(self.centralWidget)
+
+        # VTK Widget
+        self.vtkWidget = QVTKRenderWindowInteractor(self.centralWidget)
+        self.gridlayout.addWidget(self.vtkWidget, 0, 0, 4, 4)
+
+        # One slider per slice orientation
+        self.sliders = []
+        self.labels = []
+        for row, orientation in enumerate(self.ORIENTATIONS):
+            slider = QSlider(Qt.Horizontal)
+            label = QLabel(f"{orientation} slice:")
+            self.gridlayout.addWidget(label, 4 + row, 0)
+            self.gridlayout.addWidget(slider, 4 + row, 1, 1, 3)
+            self.sliders.append(slider)
+            self.labels.append(label)
+
+        self.setCentralWidget(self.centralWidget)
+        self.setWindowTitle("DTI Slice Browser")
+
+    def setup_vtk_pipeline(self):
+        self.actors = []
+        self.ren = vtk.vtkRenderer()
+        for orientation, index, color in zip(self.ORIENTATIONS, self.indices, self.COLORS):
+            actor = create_glyph_actor(self.cache.get(orientation, index), color)
+            self.ren.AddActor(actor)
+            self.actors.append(actor)
+        self.ren.SetBackground(0, 0, 0)
+        self.ren.ResetCamera()
+        self.vtkWidget.GetRenderWindow().AddRenderer(self.ren)
+
+        # prefetch once the user lingers on a slice
+        self.prefetch_timer = QtCore.QTimer()
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_axis = None
+
+    def setup_sliders(self):
+        dims = self.volume.GetDimensions()
+        for axis, slider in enumerate(self.sliders):
+            slider.setRange(0, dims[axis] - 1)
+            slider.setValue(self.indices[axis])
+            self.update_label(axis)
+
+    def setup_connections(self):
+        for axis, slider in enumerate(self.sliders):
+            slider.valueChanged.connect(lambda value, axis=axis: self.update_slice(axis, value))
+        self.prefetch_timer.timeout.connect(self.prefetch)
+
+    def update_label(self, axis):
+        orientation = self.ORIENTATIONS[axis]
+        position = slice_position(self.volume, orientation, self.indices[axis])
+        self.labels[axis].setText(f"{orientation} slice: {position:.1f}")
+
+    def update_slice(self, axis, index):
+        self.indices[axis] = index
+        t = time.time()
+        glyphs = self.cache.get(self.ORIENTATIONS[axis], index)
+        self.actors[axis].GetMapper().SetInputData(glyphs)
+        self.update_label(axis)
+        self.statusBar().showMessage(f"{self.ORIENTATIONS[axis]} slice {index}: {1000*(time.time() - t):.0f} ms "
+                                     f"({self.cache.hits} hits, {self.cache.misses} misses)")
+        self.vtkWidget.GetRenderWindow().Render()
+        self.prefetch_axis = axis
+        self.prefetch_timer.start(self.prefetch_delay)
+
+    def prefetch(self):
+        if self.prefetch_axis is not None:
+            self.cache.prefetch(self.ORIENTATIONS[self.prefetch_axis], self.indices[self.prefetch_axis])
+
+def browse_slices(volume, positions, args):
+    app = QApplication(sys.argv)
+    window = SliceBrowserUI(volume, positions, args)
+    window.resize(1024, 768)
+    window.show()
+    window.iren = window.vtkWidget.GetRenderWindow().GetInteractor()
+    window.iren.Initialize()
+    sys.exit(app.exec_())
@@ -1,5 +1,9 @@
 import vtk
 import argparse
+import threading
+from collections import OrderedDict
+import numpy as np
+from vtk.util import numpy_support as nps
 from SuperquadricTensorGlyph import SuperquadricTensorGlyph
 
 def read_dti_volume(input_file):
@@ -46,19 +50,235 @@ def probe_volume_with_plane(volume, plane_source):
     probe.Update()
     return probe.GetOutput()
 
-def create_tensor_glyphs(probed_slice, scale=1000, maxsize=10, gamma=5, resolution=20):
+# If plane_source samples the volume exactly on its grid along an axis-
+# aligned slice (as created by create_plane_source), return the axes
+# (u, v, w) of its first and second directions and of its normal.
+# Otherwise return None
+def grid_plane_axes(volume, plane_source):
+    if not isinstance(volume, vtk.vtkImageData):
+        return None
+    if hasattr(volume, 'GetDirectionMatrix') and not volume.GetDirectionMatrix().IsIdentity():
+        return None
+    bounds = np.array(volume.GetBounds()).reshape((3, 2))
+    dims = volume.GetDimensions()
+    origin = np.array(plane_source.GetOrigin())
+    d1 = np.array(plane_source.GetPoint1()) - origin
+    d2 = np.array(plane_source.GetPoint2()) - origin
+    u = int(np.argmax(np.abs(d1)))
+    v = int(np.argmax(np.abs(d2)))
+    if u >= v or np.count_nonzero(d1) != 1 or np.count_nonzero(d2) != 1:
+        return None
+    w = 3 - u - v
+    tol = 1.0e-6 * np.max(bounds[:, 1] - bounds[:, 0])
+    if np.abs(origin[u] - bounds[u, 0]) > tol or np.abs(d1[u] - (bounds[u, 1] - bounds[u, 0])) > tol or \
+       np.abs(origin[v] - bounds[v, 0]) > tol or np.abs(d2[v] - (bounds[v, 1] - bounds[v, 0])) > tol:
+        return None
+    if plane_source.GetXResolution() != dims[u] - 1 or plane_source.GetYResolution() != dims[v] - 1:
+        return None
+    if origin[w] < bounds[w, 0] - tol or origin[w] > bounds[w, 1] + tol:
+        return None
+    return u, v, w
+
+# Same result as probe_volume_with_plane for grid-coincident axis-aligned
+# planes, taken directly from the voxels of the volume (linear blend of the
+# two nearest slices if the plane lies between them). Arrays share memory
+# with the volume when the slice is contiguous
+def extract_grid_slice(volume, plane_source, axes):
+    u, v, w = axes
+    dims = volume.GetDimensions()
+    origin = volume.GetOrigin()
+    spacing = volume.GetSpacing()
+    x = (plane_source.GetOrigin()[w] - origin[w]) / spacing[w]
+    k = int(np.clip(np.floor(x + 1.0e-6), 0, dims[w] - 1))
+    t = x - k if k < dims[w] - 1 else 0
+    if t < 1.0e-6:
+        t = 0
+
+    # numpy arrays are indexed (z, y, x), so axis w is numpy axis 2-w
+    def slab(array, index):
+        values = nps.vtk_to_numpy(array).reshape((dims[2], dims[1], dims[0], -1))
+        ids = [ slice(None) ] * 3
+        ids[2 - w] = index
+        return values[tuple(ids)].reshape((dims[v] * dims[u], -1))
+
+    output = vtk.vtkPolyData()
+    coords = np.zeros((dims[v], dims[u], 3))
+    coords[:, :, u] = (origin[u] + spacing[u] * np.arange(dims[u]))[np.newaxis, :]
+    coords[:, :, v] = (origin[v] + spacing[v] * np.arange(dims[v]))[:, np.newaxis]
+    coords[:, :, w] = plane_source.GetOrigin()[w]
+    points = vtk.vtkPoints()
+    points.SetData(nps.numpy_to_vtk(coords.reshape((-1, 3))))
+    output.SetPoints(points)
+
+    point_data = volume.GetPointData()
+    for i in range(point_data.GetNumberOfArrays()):
+        array = point_data.GetArray(i)
+        if array is None:
+            continue
+        values = slab(array, k)
+        if t > 0:
+            values = ((1 - t) * values + t * slab(array, k + 1)).astype(values.dtype)
+        values = np.ascontiguousarray(values)
+        if values.shape[1] == 1:
+            values = values.ravel()
+        sliced = nps.numpy_to_vtk(values, array_type=array.GetDataType())
+        sliced.SetName(array.GetName())
+        output.GetPointData().AddArray(sliced)
+    for attribute in range(vtk.vtkDataSetAttributes.NUM_ATTRIBUTES):
+        array = point_data.GetAttribute(attribute)
+        if array is not None and array.GetName() is not None:
+            output.GetPointData().SetActiveAttribute(array.GetName(), attribute)
+    return output
+
+# Sample the volume on the plane, directly from the voxels when the plane
+# is grid-coincident and axis-aligned, with a vtkProbeFilter otherwise
+def slice_volume(volume, plane_source):
+    axes = grid_plane_axes(volume, plane_source)
+    if axes is None:
+        return probe_volume_with_plane(volume, plane_source)
+    return extract_grid_slice(volume, plane_source, axes)
+
+def create_tensor_glyph_filter(probed_slice, scale=1000, maxsize=10, gamma=5, resolution=20, minfa=0, mintrace=0):
     glyph = SuperquadricTensorGlyph()
     glyph.SetInputData(probed_slice)
     glyph.SetGamma(gamma)
     glyph.SetMaxSize(maxsize)
     glyph.SetResolution(resolution)
     glyph.SetScale(scale)
+    # skip background (zero tensors) and points outside the volume
+    glyph.SetMinFA(minfa)
+    glyph.SetMinTrace(mintrace)
+    if probed_slice.GetPointData().GetArray('vtkValidPointMask') is not None:
+        glyph.SetMaskArray('vtkValidPointMask')
+    return glyph
+
+def create_tensor_glyphs(probed_slice, **kwargs):
+    glyph = create_tensor_glyph_filter(probed_slice, **kwargs)
     glyph.Update()
     return glyph.GetOutput()
 
+def slice_position(volume, orientation, index):
+    axis = 'XYZ'.index(orientation)
+    return volume.GetOrigin()[axis] + index * volume.GetSpacing()[axis]
+
+def slice_index(volume, orientation, position):
+    axis = 'XYZ'.index(orientation)
+    index = int(round((position - volume.GetOrigin()[axis]) / volume.GetSpacing()[axis]))
+    return min(max(index, 0), volume.GetDimensions()[axis] - 1)
+
+'''
+LRU cache of glyph geometry per (orientation, slice index, glyph parameters).
+Neighbors of the last requested slices can be computed ahead of time by a
+background thread, which only ever works on the most recent prefetch request.
+Slices are grid-aligned so they are extracted without vtkProbeFilter
+'''
+class SliceGlyphCache:
+    def __init__(self, volume, capacity=64, prefetch=3, **glyph_params):
+        self.volume = volume
+        self.capacity = capacity
+        self.prefetch_distance = prefetch
+        self.glyph_params = glyph_params
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.pending = []
+        # keys of the slices being computed, by either thread
+        self.computing = set()
+        self.condition = threading.Condition(self.lock)
+        self.worker = None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, orientation, index):
+        return (orientation, index, tuple(sorted(self.glyph_params.items())))
+
+    def set_glyph_params(self, **glyph_params):
+        with self.lock:
+            self.glyph_params = dict(self.glyph_params, **glyph_params)
+            self.pending = []
+
+    def compute(self, orientation, index, glyph_params):
+        bounds = self.volume.GetBounds()
+        dims = self.volume.GetDimensions()
+        plane = create_plane_source(slice_position(self.volume, orientation, index), orientation, bounds, dims)
+        return create_tensor_glyphs(slice_volume(self.volume, plane), **glyph_params)
+
+    def store(self, key, glyphs):
+        self.entries[key] = glyphs
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    # Compute the glyphs of a slice marked as being computed, then wake up
+    # the threads waiting for it. keep tells whether to store the result
+    def compute_marked(self, key, orientation, index, glyph_params, keep=lambda key: True):
+        glyphs = None
+        try:
+            glyphs = self.compute(orientation, index, glyph_params)
+        finally:
+            with self.condition:
+                if glyphs is not None and keep(key):
+                    self.store(key, glyphs)
+                self.computing.discard(key)
+                self.condition.notify_all()
+        return glyphs
+
+    '''
+    Glyphs of the given slice. On a miss, they are computed in the calling
+    thread, unless the prefetch thread is already computing them, in which
+    case its result is awaited
+    '''
+    def get(self, orientation, index):
+        with self.condition:
+            key = self.key(orientation, index)
+            glyph_params = self.glyph_params
+            while key in self.computing and key not in self.entries:
+                self.condition.wait()
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+            self.computing.add(key)
+        return self.compute_marked(key, orientation, index, glyph_params)
+
+    '''
+    Queue the neighbors of the slice, closest first, replacing any earlier
+    prefetch requests that have not been processed yet
+    '''
+    def prefetch(self, orientation, index):
+        size = self.volume.GetDimensions()['XYZ'.index(orientation)]
+        neighbors = []
+        for d in range(1, self.prefetch_distance + 1):
+            neighbors += [ i for i in (index + d, index - d) if 0 <= i < size ]
+        with self.condition:
+            self.pending = [ (orientation, i) for i in neighbors ]
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+            # get may be waiting on the same condition
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                orientation, index = self.pending.pop(0)
+                key = self.key(orientation, index)
+                glyph_params = self.glyph_params
+                if key in self.entries or key in self.computing:
+                    continue
+                self.computing.add(key)
+            # parameters may have changed during the computation
+            self.compute_marked(key, orientation, index, glyph_params,
+                                keep=lambda key: key == self.key(orientation, index))
+
 def create_glyph_actor(glyph_data, color):
     mapper = vtk.vtkPolyDataMapper()
-    mapper.SetInputData(glyph_data)
+    if isinstance(glyph_data, vtk.vtkAlgorithm):
+        mapper.SetInputConnection(glyph_data.GetOutputPort())
+    else:
+        mapper.SetInputData(glyph_data)
     actor = vtk.vtkActor()
     actor.SetMapper(mapper)
     actor.GetProperty().SetColor(*color)
@@ -84,11 +304,22 @@ def main():
     parser.add_argument("-X", type=float, dest="X", help="X slice position (world coordinate)")
     parser.add_argument("-Y", type=float, dest="Y", help="Y slice position (world coordinate)")
     parser.add_argument("-Z", type=float, dest="Z", help="Z slice position (world coordinate)")
+    parser.add_argument("--minfa", type=float, default=0, help="Do not draw glyphs with lower FA")
+    parser.add_argument("--lod", action="store_true", help="Adapt glyph resolution to their size on screen")
+    parser.add_argument("--interactive", action="store_true", help="Browse slices with sliders")
+    parser.add_argument("--cache-size", type=int, default=64, help="Number of glyph slices kept in interactive mode")
+    parser.add_argument("--prefetch", type=int, default=3, help="Neighboring slices computed ahead in interactive mode")
     args = parser.parse_args()
 
     # Read the DTI volume
     volume = read_dti_volume(args.i)
 
+    if args.interactive:
+        # Qt is only needed for the interactive mode
+        from slice_browser import browse_slices
+        browse_slices(volume, determine_slice_positions(volume, args), args)
+        return
+
     # Determine slice positions
     sliceX, sliceY, sliceZ = determine_slice_positions(volume, args)
 
@@ -99,15 +330,21 @@ def main():
     planeY = create_plane_source(sliceY, 'Y', bounds, dims)
     planeZ = create_plane_source(sliceZ, 'Z', bounds, dims)
 
-    # Probe the volume with each plane
-    probedSliceX = probe_volume_with_plane(volume, planeX)
-    probedSliceY = probe_volume_with_plane(volume, planeY)
-    probedSliceZ = probe_volume_with_plane(volume, planeZ)
+    # Sample the volume on each plane
+    probedSliceX = slice_volume(volume, planeX)
+    probedSliceY = slice_volume(volume, planeY)
+    probedSliceZ = slice_volume(volume, planeZ)
 
-    # Create tensor glyphs for each slice
-    glyphsX = create_tensor_glyphs(probedSliceX)
-    glyphsY = create_tensor_glyphs(probedSliceY)
-    glyphsZ = create_tensor_glyphs(probedSliceZ)
+    # Create tensor glyphs for each slice. With level of detail, glyphs
+    # stay connected to the pipeline to follow camera changes
+    if args.lod:
+        glyphsX = create_tensor_glyph_filter(probedSliceX, minfa=args.minfa)
+        glyphsY = create_tensor_glyph_filter(probedSliceY, minfa=args.minfa)
+        glyphsZ = create_tensor_glyph_filter(probedSliceZ, minfa=args.minfa)
+    else:
+        glyphsX = create_tensor_glyphs(probedSliceX, minfa=args.minfa)
+        glyphsY = create_tensor_glyphs(probedSliceY, minfa=args.minfa)
+        glyphsZ = create_tensor_glyphs(probedSliceZ, minfa=args.minfa)
 
     # Create actors for the glyphs with distinct colors
     actorX = create_glyph_actor(glyphsX, (1.0, 0.0, 0.0))  # red for X slice
@@ -116,6 +353,9 @@ def main():
 
     # Set up renderer and rendering window
     renderer, interactor = setup_renderer_and_window([actorX, actorY, actorZ])
+    if args.lod:
+        for glyphs in [glyphsX, glyphsY, glyphsZ]:
+            glyphs.SetLODRenderer(renderer)
 
     # Render and start interaction
     renderer.ResetCamera()
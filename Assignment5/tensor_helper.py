@@ -0,0 +1,19 @@
+import numpy as np
+
+'''
+Tensor measures shared by the glyph, seeding and fiber scripts. Only numpy
+is needed, so that importing them does not load the glyph filter and its
+dependencies. Zero tensors have an FA of nan
+'''
+
+# FA from the eigenvalues, shape = (n, 3)
+def fa(evals):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(np.square(evals[:,0]-evals[:,1]) + np.square(evals[:,1]-evals[:,2]) + np.square(evals[:,2]-evals[:,0]))/ np.sqrt(2*(np.square(evals[:,0]) + np.square(evals[:,1]) + np.square(evals[:,2])))
+
+# FA computed from the tensor invariants, without eigendecomposition
+def tensor_fa(tensors):
+    trace = np.trace(tensors, axis1=-2, axis2=-1)
+    dev = tensors - (trace/3)[:, np.newaxis, np.newaxis] * np.eye(3)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(1.5 * np.sum(np.square(dev), axis=(-2,-1)) / np.sum(np.square(tensors), axis=(-2,-1)))